@@ -1,9 +1,10 @@
-from struct import *  # To pack and unpack
 import ipaddress  # In order to check for valid IP-addresses
 import argparse  # In order to utilize arguments
-import socket  # Import of socket module
-import time  # In order to utilize time
 import sys  # In order to terminate the program
+import asyncio  # In order to run the client and the server on an event loop
+import logging  # In order to choose how much the library reports
+import json  # In order to write the metrics as JSON lines
+from drtp import DRTPSender, DRTPReceiver, serve_workers  # The DRTP library doing the transfers
 
 ###################
 # ARGUMENT PARSER #
@@ -15,30 +16,74 @@ parser = argparse.ArgumentParser(
 
 # Arguments used for the client/sender
 parser.add_argument('-c', '--client', action='store_true', help='enable client mode')
-parser.add_argument('-f', '--file', type=str, choices=['picture.jpg', 'safi.jpg'], help='input a file to be sent')
+parser.add_argument('-f', '--file', type=str, help='input a file to be sent')
+parser.add_argument('--rate', type=float, default=0,
+                    help='pace the GBN and SR senders at this rate in Mbps (0 sends the window at once)')
+parser.add_argument('--pace', action='store_true',
+                    help='pace the GBN and SR senders at a rate that follows the window and the RTT')
+parser.add_argument('--streams', type=int, default=1,
+                    help='split the file into this many byte ranges, sent in parallel from processes of their own')
+parser.add_argument('--dedup', action='store_true',
+                    help='only send the blocks of the file the server does not have in its cache')
+parser.add_argument('--compress', choices=['zlib', 'lzma'],
+                    help='compress the file in blocks ahead of the window, if the server accepts it')
+parser.add_argument('--level', type=int,
+                    help='compression level (0-9 for zlib and lzma, the default of the method if not given)')
+parser.add_argument('--checksum', action='store_true',
+                    help='send a CRC32 with every segment and a digest of the data in the FIN, checked by the server')
 
 # Arguments used for the server/receiver
 parser.add_argument('-s', '--server', action='store_true', help='enable server mode')
+parser.add_argument('-o', '--output', type=str, default='safi-recv.jpg', help='file the received data is written to')
+parser.add_argument('-b', '--batch', type=int, default=64,
+                    help='number of in-order segments written to the output file at once')
+parser.add_argument('--preallocate', action='store_true',
+                    help='preallocate disk space for the output file ahead of the writes')
+parser.add_argument('-k', '--keep-running', action='store_true',
+                    help='keep serving clients after the first transfer, with one output file per connection')
+parser.add_argument('--max-sessions', type=int, default=16, help='number of clients served at the same time')
+parser.add_argument('--workers', type=int, default=1,
+                    help='serve the clients from this many processes that share the port with SO_REUSEPORT')
+parser.add_argument('--ack-every', type=int, default=1,
+                    help='acknowledge every N in-order packets (delayed acks, not used by stop-and-wait)')
+parser.add_argument('--ack-delay', type=float, default=5,
+                    help='longest time in ms an ack is delayed when --ack-every is above 1')
+parser.add_argument('--cache', type=str,
+                    help='directory of the block cache, so clients with --dedup only send the blocks it lacks')
+parser.add_argument('--cache-size', type=int, default=1024, help='largest size of the block cache in MB')
 
 # Arguments common for both server and client
 parser.add_argument('-p', '--port', type=int, default=8088, help='allows selection of a port', metavar='[1024-65535]')
 parser.add_argument('-i', '--ipaddress', type=str, default='127.0.0.1', help='allows selection of an ip-address')
 parser.add_argument('-r', '--reliability', choices=['stop-and-wait', 'GBN', 'SR'], required=True,
                     help='allows selection of different reliability functions')
+parser.add_argument('-w', '--window', type=int, default=5,
+                    help='window size in packets for GBN and SR (the server advertises its own in the SYN ACK)',
+                    metavar='[1-65535]')
+parser.add_argument('--cc', choices=['none', 'reno', 'cubic'], default='none',
+                    help='congestion control used by the GBN and SR senders (none keeps the window fixed)')
+parser.add_argument('--asyncio', action='store_true',
+                    help='run the client or the server on an asyncio event loop instead of blocking sockets')
+parser.add_argument('--io', choices=['single', 'batch', 'mmsg'], default='single',
+                    help='datagram I/O of the blocking client and server: one system call per datagram, '
+                         'bursts and drains of many datagrams, or sendmmsg/recvmmsg')
+parser.add_argument('--mss', type=int, default=1460,
+                    help='largest segment size in bytes, negotiated in the handshake (the client probes the path '
+                         'with it and falls back towards 1460)', metavar='[1-65495]')
+parser.add_argument('--resume', action='store_true',
+                    help='resume interrupted transfers: the server keeps checkpoints of unfinished transfers, '
+                         'and the client only sends what the server is missing')
 parser.add_argument('-t', '--test', type=str, choices=['skip_ack', 'skip_seq'],
                     help='selection of which test case to run')
+parser.add_argument('-v', '--verbose', action='store_true', help='print every packet sent and received')
+parser.add_argument('-q', '--quiet', action='store_true', help='only print warnings and the results')
+parser.add_argument('--metrics', type=str,
+                    help='append the metrics of every transfer (client) or session (server) to this file as JSON lines')
+parser.add_argument('--metrics-interval', type=float, default=0,
+                    help='also append a snapshot of the metrics of the client every this many seconds')
 
 args = parser.parse_args()  # Start the argument parser and its arguments
 
-################
-# MAIN PROGRAM #
-################
-
-# GLOBAL VARIABLES #
-header_format = '!IIHH'
-rtt = 0.125  # Default rtt (sets time-outs to 500 ms)
-
-
 #############
 # FUNCTIONS #
 #############
@@ -86,611 +131,137 @@ def check_port(val):
     return value  # Lastly, the checked port will be returned and used in the program
 
 
-# A function which creates a packet (data and header - 1472 bytes)
-def create_packet(seq, ack, flags, win, data):
-    # creates a packet with header information and application data
-    # the input arguments are sequence number, acknowledgment number
-    # flags (we only use 4 bits),  receiver window and application data
-    # struct.pack returns a bytes object containing the header values
-    # packed according to the header_format !IIHH
-    header = pack(header_format, seq, ack, flags, win)
-
-    # once we create a header, we add the application data to create a packet
-    # of 1472 bytes
-    packet = header + data
-    # print(f'packet containing header + data of size {len(packet)}')  # to show the length of the packet
-    return packet
-
-
-# A function that parses/unpacks a header
-def parse_header(header):
-    # taks a header of 12 bytes as an argument,
-    # unpacks the value based on the specified header_format
-    # and return a tuple with the values
-    header_from_msg = unpack(header_format, header)
-    # parse_flags(flags)
-    return header_from_msg
-
-
-# A function that parses/unpacks flags
-def parse_flags(flags):
-    # we only parse the first 3 fields because we're not
-    # using rst in our implementation
-    syn = flags & (1 << 3)
-    ack = flags & (1 << 2)
-    fin = flags & (1 << 1)
-    return syn, ack, fin
-
-
-# Main functions #
-# Stop-and-wait (client)
-def stop_and_wait_c():
-    # CLIENT
-    data = []
-    sequence = 1  # Needed for the first sequence
-    body = b''
-    flags = 0
-    rtt = 0.125
-
-    # Opens the file
-    with open(args.file, 'rb') as file:
-        img = file.read()
-
-    # Turns the data into a list of elements with length 1460
-    for i in range(0, len(img), 1460):
-        data.append(img[i:i + 1460])
-
-    # Test case skip_seq
-    if args.test == 'skip_seq':
-        skip = True  # A skip to be done
-        skip_seq = 5  # Skips packet #5
-    else:
-        skip = False
-        skip_seq = 0
-
-    # Send the content of the requested file to the server
-    while True:
-        if sequence <= len(data):
-            print(f'\ncreating a packet #{sequence}')
-            # Extracts next data-sequence
-            body = data[sequence - 1]
-            # adds a FIN flag if it is the last sequence
-            flags = 0 if sequence <= len(data) else 2
-        elif sequence > len(data):
-            print("\nAll data sent")
-            # Returns data size for calculation of throughput value
-            return 1460 * len(data)
-
-        print(f'data size = {len(body)}')
-        # Acknowledgement number and window are fixed and static for the client
-        msg = create_packet(sequence, 0, flags, 0, body)
-        """
-        # Starts measuring RTT before sending of packet
-        rtt_start_time = time.time()
-        rtt_start_seq = sequence
-        """
-        # Skips sequence (skip_seq) if test 1 is active
-        if skip and sequence == skip_seq:
-            skip = False  # To keep it from skipping multiple times
-            print("Packet sending skipped")
-        else:
-            # Send packet
-            sender_socket.sendto(msg, receiver_address)
-
-        # Sets timeout
-        sender_socket.settimeout(4 * rtt)
-        try:
-            # listens for ack from server that the packet has been received
-            ack_msg = sender_socket.recv(12)
-            seq, ack, flags, win = parse_header(ack_msg)  # it's an ack message with only the header
-            SYN, ACK, FIN = parse_flags(flags)
-            """
-            # Sets rtt if correct packet is received
-            if rtt_start_seq == ack:
-                rtt = time.time() - rtt_start_time
-                print(f"RTT: {(rtt * 1000):.2f} ms")
-            """
-            if ACK:
-                if sequence == ack:
-                    print(f"Correct ACK received #{sequence}")
-                    sequence += 1
-                else:
-                    print("Wrong ACK received")
-
-        except socket.timeout:
-            print(f"Timed out: ACK not received - resending packet #{sequence}")
-            continue
-
-
-# Go-Back-N (client)
-def gbn_c():
-    # CLIENT
-    data = []  # In order to store the data
-    sequence = 1  # Needed for the first sequence
-    window = 5  # Window is fixed
-
-    with open(args.file, 'rb') as file:
-        img = file.read()
-
-    # Turns the data into a list of elements with length 1460
-    for i in range(0, len(img), 1460):
-        data.append(img[i:i + 1460])
-
-    # Initialising for test case skip_seq
-    if args.test == 'skip_seq':
-        skip = True  # A skip to be done
-        skip_seq = 5  # Skips packet #5
-    else:
-        skip = False
-        skip_seq = 0
-
-    # Send the content of the requested file to the server
-    #while True:
-    print(f"\nCreating {window} packets")
-    for i in range(0, window):
-        print(f"Creating window-packet #{i + 1}")
-        if sequence + i > len(data):
-            break
-        # Extracts next data-sequence
-        body = data[sequence - 1 + i]
-        # adds a FIN flag if it is the last sequence
-        flags = 0 if sequence <= len(data) else 2
-        # Acknowledgement number and window in the header are fixed and static for the client
-        msg = create_packet(sequence, 0, flags, 0, body)
-
-        # Skips sequence #2 (skip_seq) if test 1 is active
-        if skip and sequence == skip_seq:
-            skip = False  # To keep it from skipping multiple times
-        else:
-            # Send packet and set the timeout
-            sender_socket.sendto(msg, receiver_address)
-
-        sender_socket.settimeout(4 * rtt)
-    print()
-    while True:
-        try:
-            while True:
-                # Listens for ack from server that the packet has been received
-                ack_msg = sender_socket.recv(12)
-                seq, ack, flags, win = parse_header(ack_msg)  # it's an ack message with only the header
-                SYN, ACK, FIN = parse_flags(flags)
-
-                if ACK and sequence == ack:
-                    print(f"Correct ACK received #{sequence}")
-                    sequence += 1
-                    # All data sent and all ACKs are received - Transfer is done
-                    if sequence > len(data):
-                        print("\nAll data sent")
-                        # Returns data size for calculation of throughput value
-                        return 1460 * len(data)
-
-                    # Extracts next data-sequence
-                    body = data[sequence - 1]
-
-                    # adds a FIN flag if it is the last sequence
-                    flags = 0 if sequence <= len(data) else 2
-                    msg = create_packet(sequence, 0, flags, 0, body)
-
-                    # Skips sequence #skip_seq (skip_seq) if test 1 is active
-                    if skip and sequence == skip_seq:
-                        skip = False  # To keep it from skipping multiple times
-                    else:
-                        # Send packet
-                        sender_socket.sendto(msg, receiver_address)
-
-                    # Sets timeout
-                    sender_socket.settimeout(4 * rtt)
-
-        except socket.timeout:
-            print(f"\nTimed out: ACK not received - resending from packet #{sequence}")
-            for i in range(0, window):
-                print(f"Creating window-packet #{sequence + i}")
-                if sequence + i > len(data):
-                    break
-                # Extracts next data-sequence
-                body = data[sequence - 1 + i]
-                # adds a FIN flag if it is the last sequence
-                flags = 0 if sequence <= len(data) else 2
-                # Acknowledgement number and window in the header are fixed and static for the client
-                msg = create_packet(sequence, 0, flags, 0, body)
-
-                sender_socket.sendto(msg, receiver_address)
-                sender_socket.settimeout(4 * rtt)
-
-            continue
-
-
-# Selective repeat (client)
-def sr_c():
-    # CLIENT
-    data = []  # In order to store the data
-    sequence = 1  # Needed for the first sequence
-    window = 5  # Window is fixed
-    frame = [False] * window  # Frame to keep track of acked sequences within the window
-
-    with open(args.file, 'rb') as file:
-        img = file.read()
-
-    # Turns the data into a list of elements with length 1460
-    for i in range(0, len(img), 1460):
-        data.append(img[i:i + 1460])
-
-    # Initialising for test case skip_seq
-    if args.test == 'skip_seq':
-        skip = True  # A skip to be done
-        skip_seq = 4  # Skips packet #5
-    else:
-        skip = False
-        skip_seq = 0
-
-    # Send the content of the requested file to the server
-    while True:
-        print(f"\nCreating {window} packets")
-        for i in range(0, window):
-            print(f"Creating window-packet #{i + 1}")
-            if sequence + i > len(data) or frame[i]:
-                break
-            # Extracts next data-sequence
-            body = data[sequence - 1 + i]
-            # adds a FIN flag if it is the last sequence
-            flags = 0 if sequence <= len(data) else 2
-            # Acknowledgement number and window in the header are fixed and static for the client
-            msg = create_packet(sequence + i, 0, flags, 0, body)
-
-            # Skips sequence #2 (skip_seq) if test 1 is active
-            if skip and sequence == skip_seq:
-                skip = False  # To keep it from skipping multiple times
-            else:
-                # Send packet and set the timeout
-                sender_socket.sendto(msg, receiver_address)
-
-            sender_socket.settimeout(4 * rtt)
-
-        while True:
-            try:
-                # Listens for ack from server that the packet has been received
-                ack_msg = sender_socket.recv(12)
-                seq, ack, flags, win = parse_header(ack_msg)  # it's an ack message with only the header
-                SYN, ACK, FIN = parse_flags(flags)
-
-                # Stores ack if it is within the window
-                if ACK and sequence <= ack and sequence + window > ack:
-                    print(f"Correct ACK received #{ack} - Frame #{(ack - sequence)}")
-                    # Stores ack within the frame
-                    frame[ack - sequence] = True
-
-                # Moves the window and sends the last element after each move
-                while frame[0]:
-                    print("window moves - sends packet")
-                    frame.pop(0)
-                    frame.append(False)
-                    sequence += 1
-                    # All data sent and all ACKs are received - Transfer is done
-                    if sequence + 1 > len(data):
-                        print("\nAll data sent")
-                        # Returns data size for calculation of throughput value
-                        return 1460 * len(data)
-                    # if sequence + window > len(data):
-                    # window -= 1
-                    # adds a FIN flag if it is the last sequence
-                    flags = 0 if sequence <= len(data) else 2
-                    # Extracts next data-sequence
-                    if sequence - 1 + window < len(data):  # Checks if the index is less than the length of data
-                        body = data[sequence - 1 + window]
-                        msg = create_packet(sequence + window - 1, 0, flags, 0, body)
-                    else:
-                        break  # Breaks at the end of data
-
-                    # Skips sequence #skip_seq (skip_seq) if test 1 is active
-                    if skip and sequence == skip_seq:
-                        skip = False  # To keep it from skipping multiple times
-                    else:
-                        # Send packet
-                        sender_socket.sendto(msg, receiver_address)
-
-                    # Sets timeout
-                    sender_socket.settimeout(4 * rtt)
-
-            except socket.timeout:
-                print(f"\nTimed out: ACK not received for packet #{sequence}")
-                break
-
-
-# Server function for both stop-and-wait and GBN
-def reactive_server():
-    # SERVER - used for stop-and-wait() and GBN()
-    data = []  # Destination for received data, whose length allows for track of progress
-    sequence = 0  # Receive progress
-
-    # Test case skip_ack to skip the sending of a specific ack
-    if args.test == 'skip_ack':
-        skip = True  # A skip to be done
-        skip_ack = 5  # Skips ack #5
-    else:
-        skip = False
-        skip_ack = 0
-
-    # Retrieves all data
-    while True:
-        print("Receiving . . . ")
-        # Receiving from client
-        msg, sender_address = receiver_socket.recvfrom(1472)
-
-        # Parsing the header
-        header_from_msg = msg[:12]
-        seq, ack, flags, win = parse_header(header_from_msg)
-        print(f'\nseq={seq}, ack={ack}, flags={flags}, receiver-window={win}')
-        SYN, ACK, FIN = parse_flags(flags)
-
-        if seq > 0:
-            if seq == sequence + 1:
-                print(f"Correct packet received #{seq}")
-                data.append(msg[12:])  # Stores decoded data
-                sequence += 1  # Increments progress
-
-            # Sequence number, flags, window, and body are fixed for the server
-            msg = create_packet(0, sequence, 4, 0, b'')
-
-            # Skips ack (skip_ack) if the respective test is active triggering a retransmission
-            if skip and sequence == skip_ack:
-                skip = False  # To keep it from skipping multiple times
-                print(f"Skipping ACK #{sequence}")
-            else:
-                # Sends ack
-                print(f'Sending acknowledgment packet #{sequence}')
-                receiver_socket.sendto(msg, sender_address)
-
-        elif FIN:
-            print("Transfer finished")
-            return b''.join(data)  # Joins data from array and returns it
-
-
-# Selective repeat (server)
-def sr_s():
-    # SERVER - Selective Repeat
-    data = []  # Destination for received data, whose length allows for track of progress
-    sequence = 0  # Receive progress
-    window = 5
-    frame = [None] * window
-
-    # Test case skip_ack to skip the sending of a specific ack
-    if args.test == 'skip_ack':
-        skip = True  # A skip to be done
-        skip_ack = 5  # Skips ack #5
-    else:
-        skip = False
-        skip_ack = 0
-
-    # Retrieves all data
-    while True:
-        # Receiving from client
-        msg, sender_address = receiver_socket.recvfrom(1472)
-
-        # Parsing the header
-        header_from_msg = msg[:12]
-        seq, ack, flags, win = parse_header(header_from_msg)
-        print(f'\nseq={seq}, ack={ack}, flags={flags}, receiver-window={win}')
-        SYN, ACK, FIN = parse_flags(flags)
-
-        if seq > 0:
-            if seq >= sequence + 1 and seq < sequence + window + 1:
-                print(f"Correct packet received #{seq}")
-                frame[seq - sequence - 1] = msg[12:]  # Buffers decoded data
-                # Moves the window and stores buffered data
-                while frame[0]:
-                    print("window moves - sends ACK")
-                    data.append(frame.pop(0))  # Pops from buffer frame into storage
-                    frame.append(None)
-                    sequence += 1
-
-            # Sequence number, flags, window, and body are fixed for the server
-            msg = create_packet(0, seq, 4, 0, b'')
-
-            # Skips ack #4 (skip_ack) if the respective test is active triggering a retransmission
-            if skip and sequence == skip_ack:
-                skip = False  # To keep it from skipping multiple times
-                print(f"Skipping ACK #{sequence}")
-            else:
-                # Sends ack
-                print(f'Sending acknowledgment packet #{seq}')
-                receiver_socket.sendto(msg, sender_address)
+# A function that checks if the window size is valid
+def check_window(value):
+    # The window is advertised in the 16 bit win field of the header
+    if not 1 <= value <= 65535:
+        print('window must be between 1 and 65535 packets')
+        sys.exit()
+    return value
 
-        elif FIN:
-            print("Transfer finished")
-            return b''.join(data)  # Joins data from array and returns it
 
+# A function that checks if the segment size is valid
+def check_mss(value):
+    # The header and the segment have to fit in one UDP datagram
+    if not 1 <= value <= 65495:
+        print('segment size must be between 1 and 65495 bytes')
+        sys.exit()
+    return value
+
+
+# A function that appends a record of metrics to the --metrics file as a line of JSON
+def write_metrics(record):
+    with open(args.metrics, 'a') as f:
+        f.write(json.dumps(record) + '\n')
+
+
+################
+# MAIN PROGRAM #
+################
 
 # Variables used for invoking the server/client #
 check_ip(args.ipaddress)
 check_port(args.port)
 ip = args.ipaddress
 port = args.port
+window_size = check_window(args.window)
+mss = check_mss(args.mss)
+report = write_metrics if args.metrics else None
+
+# The library reports the connections and the transfers, and every packet with --verbose
+level = logging.DEBUG if args.verbose else logging.WARNING if args.quiet else logging.INFO
+logging.basicConfig(format='%(message)s')
+logging.getLogger('drtp').setLevel(level)
 
 # If using both the --s and the --c flag (AND reliability), the system will exit
 if args.server and args.client:
     print("Error: you can not run both in server and client mode")
     sys.exit()
-# SENDER SOCKET (CLIENT) #
-elif args.client:
-    # Creating the sender socket and specifying the receiver address
-    sender_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-    receiver_address = (ip, port)
-
-    # ESTABLISHING A CONNECTION FIRST #
-    sequence_number = 0
-    acknowledgment_number = 0  # an ack for the last sequence
-    window = 0  # window value should always be sent from the receiver-side
-    body = b''
-
-    # S A F R - SYN ACK FIN RST
-    flags = 8  # 1 0 0 0  SYN flag
-
-    # Sends SYN flag to initiate the thee-way handshake
-    msg = create_packet(sequence_number, acknowledgment_number, flags, window, body)
-    sender_socket.sendto(msg, receiver_address)
-    print("SYN sent")
 
-    # Setting timeout
-    sender_socket.settimeout(4 * rtt)
-    print("Setting timeout: 4RTTs")
-
-    try:
-        # Try to receive SYN ACK from server
-        syn_ack_msg = sender_socket.recv(12)
-
-        # Parsing the header
-        seq, ack, flags, win = parse_header(syn_ack_msg)  # SYN ACK -> only header with flags set to: 1 1 0 0
-        SYN, ACK, FIN = parse_flags(flags)
-
-        if SYN and ACK:
-            print(f"SYN ACK received: flags set: syn-> {SYN}, ack-> {ACK}, fin-> {FIN}")
-
-            sequence_number = 0
-            acknowledgment_number = 0  # an ack for the last sequence
-            window = 0  # window value should always be sent from the receiver-side
-            body = b''
-
-            # S A F R - SYN ACK FIN RST
-            flags = 4  # 0 1 0 0  ACK flag
-            msg = create_packet(sequence_number, acknowledgment_number, flags, window, body)
-
-            # Sending ACK to confirm an established connection
-            sender_socket.sendto(msg, receiver_address)
-            print("ACK sent")
-            print("Connection established..")
-
-    except socket.timeout:
-        print("Timed out: Didn't receive a SYN ACK")
-        sys.exit()
+# SENDER (CLIENT) #
+elif args.client:
+    # The sender makes the handshake, the transfer and the FIN with the chosen -r argument
+    with DRTPSender((ip, port), args.reliability, window_size, args.cc, args.test, args.io,
+                    rate=args.rate * 125_000, pace=args.pace, mss=mss, report=report,
+                    report_interval=args.metrics_interval, resume=args.resume, dedup=args.dedup,
+                    compression=args.compress, level=args.level,
+                    checksum=args.checksum) as sender:
+        try:
+            if args.streams > 1:
+                data_size, lapsed_time = sender.send_parallel(args.file, args.streams, args.asyncio)
+            elif args.asyncio:
+                data_size, lapsed_time = asyncio.run(sender.send_file_async(args.file))
+            else:
+                data_size, lapsed_time = sender.send_file(args.file)
+        except (TimeoutError, OSError) as e:
+            print("Transfer failed:", e)
+            if args.resume:
+                print("Run the client again with --resume to send the rest")
+            sys.exit()
 
-    start_time = time.time()
-    data_size = 0
-    # When a connection is established, the chosen -r argument will start its respective method
-    if args.reliability == "stop-and-wait":
-        data_size = stop_and_wait_c()
-    elif args.reliability == "GBN":
-        data_size = gbn_c()
-    elif args.reliability == "SR":
-        data_size = sr_c()
-
-    # Lapsed time in ms
-    lapsed_time = (time.time() - start_time) * 1000
     # Throughput value in Mbps
     throughput = data_size / lapsed_time / 1_000 * 8
+    print(f"\nElapsed time: {lapsed_time:.2f}ms")
+    print(f"Throughput: {throughput:.2f}Mbps")
+    print("Shutting down..")
+    sys.exit()
 
-    # Closing of the connection
-    sequence_number = 0
-    acknowledgment_number = 0  # an ack for the last sequence
-    window = 0  # window value should always be sent from the receiver-side
-    body = b''
+# RECEIVER (SERVER) WITH WORKERS #
+elif args.server and args.workers > 1:
+    # Start-up
+    startupMsg = f"A server is listening on port {port} with {args.workers} workers"
 
-    # S A F R - SYN ACK FIN RST
-    flags = 2  # 0 0 1 0  FIN flag
-    msg = create_packet(sequence_number, acknowledgment_number, flags, window, body)
+    # Output with dashes
+    print("-" * len(startupMsg))
+    print(startupMsg)
+    print("-" * len(startupMsg))
 
-    sender_socket.settimeout(4 * rtt)
-    while True:
-        try:
-            sender_socket.sendto(msg, receiver_address)
-            print("FIN sent")
-
-            ack_msg = sender_socket.recv(12)
-
-            # Parsing the header
-            seq, ack, flags, win = parse_header(ack_msg)  # ACK -> only header with flags set to: 0 1 0 0
-            SYN, ACK, FIN = parse_flags(flags)
-
-            if ACK and ack == 0:
-                print(f"ACK received: flags set: syn-> {SYN}, ack-> {ACK}, fin-> {FIN}")
-                print(f"\nElapsed time: {lapsed_time:.2f}ms")
-                print(f"Throughput: {throughput:.2f}Mbps")
-                print("Shutting down..")
-                sender_socket.close()
-                sys.exit()
-        except socket.timeout:
-            print("Timed out: Did not receive a FIN ACK")
-            sys.exit()
+    # Every worker binds the port itself, and the supervisor prints the stats of the workers when it stops
+    try:
+        serve_workers((ip, port), args.workers, args.output, args.keep_running, args.asyncio,
+                      reliability=args.reliability, window=window_size, ack_every=args.ack_every,
+                      ack_delay=args.ack_delay / 1000, batch=args.batch, preallocate=args.preallocate,
+                      max_sessions=args.max_sessions, test=args.test, io_mode=args.io, mss=mss, report=report,
+                      resume=args.resume, cache=args.cache, cache_size=args.cache_size << 20)
+    except OSError as e:
+        print('Bind failed..', e)
+    sys.exit("Shutting down..")
 
-# RECEIVER SOCKET (SERVER) #
+# RECEIVER (SERVER) #
 elif args.server:
-    # Creating the receiver socket and specifying the receiver address
-    receiver_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-
     # Attempting to bind server's port and IP
     try:
-        # Start-up
-        receiver_socket.bind((ip, port))
-        startupMsg = "A server is listening on port " + str(port)
-
-        # Output with dashes
-        print("-" * len(startupMsg))
-        print(startupMsg)
-        print("-" * len(startupMsg))
-
+        receiver = DRTPReceiver((ip, port), args.reliability, window_size, args.ack_every, args.ack_delay / 1000,
+                                args.batch, args.preallocate, args.max_sessions, args.test, args.io, mss,
+                                report=report, resume=args.resume, cache=args.cache,
+                                cache_size=args.cache_size << 20)
     # If not, print an exception message and close the program
     except Exception as e:
         print('Bind failed..', e)
         sys.exit()
 
-    # ESTABLISHING CONNECTION #
-    while True:
-        # Waits for the SYN from client
+    # Start-up
+    startupMsg = "A server is listening on port " + str(port)
+
+    # Output with dashes
+    print("-" * len(startupMsg))
+    print(startupMsg)
+    print("-" * len(startupMsg))
+
+    # Serves the clients until the first transfer is done, or for as long as it runs with --keep-running
+    with receiver:
         try:
-            syn_or_ack, sender_address = receiver_socket.recvfrom(12)
-            # Parsing the header
-            seq, ack, flags, win = parse_header(syn_or_ack)  # SYN -> only header with flags set to: 1 0 0 0
-            SYN, ACK, FIN = parse_flags(flags)
-
-            if SYN:
-                print(f"SYN received: flags set: syn-> {SYN}, ack-> {ACK}, fin-> {FIN}")
-
-                # Sends SYN ACK
-                sequence_number = 0
-                acknowledgment_number = 0  # an ack for the last sequence
-                window = 0  # window value should always be sent from the receiver-side
-                body = b''
-
-                # S A F R - SYN ACK FIN RST
-                flags = 12  # 1 1 0 0  SYN ACK flag
-
-                # Sends SYN ACK
-                msg = create_packet(sequence_number, acknowledgment_number, flags, window, body)
-                receiver_socket.sendto(msg, sender_address)
-                print("SYN ACK sent")
-                receiver_socket.settimeout(5)  # Gives a 2-second room for ack to be received
-            elif ACK:
-                print("Ready to receive a file!")
-
-                data = ''
-                if args.reliability != "SR":
-                    data = reactive_server()
-                else:
-                    data = sr_s()
-
-                # Writes or overwrites the data to a new file
-                with open('safi-recv.jpg', "wb") as file:
-                    file.write(data)
-
-                if data:
-                    # Sends ACK
-                    sequence_number = 0
-                    acknowledgment_number = 0
-                    window = 0
-                    body = b''
-
-                    # S A F R - SYN ACK FIN RST
-                    flags = 4  # 0 1 0 0 ACK flag
-
-                    msg = create_packet(sequence_number, acknowledgment_number, flags, window, body)
-                    receiver_socket.sendto(msg, sender_address)
-
-                    print("ACK sent")
-                    receiver_socket.close()
-                    sys.exit("Shutting down..")
-
-        except socket.timeout:
-            print("Timed out: Did not receive packet or ACK")
-            sys.exit("Shutting down..")
+            if args.asyncio and args.keep_running:
+                asyncio.run(receiver.serve_forever_async(args.output))
+            elif args.asyncio:
+                asyncio.run(receiver.receive_to_async(args.output))
+            elif args.keep_running:
+                receiver.serve_forever(args.output)
+            else:
+                receiver.receive_to(args.output)
+        except (TimeoutError, ConnectionError):
+            pass  # The session has already reported the time-out or the failure
+    sys.exit("Shutting down..")
 
 # If neither the -s nor -c flag is specified (except reliability), the system will also exit
 else:
@@ -0,0 +1,113 @@
+from struct import *  # To pack and unpack
+import argparse  # In order to utilize arguments
+import socket  # Import of socket module
+import timeit  # In order to time the codec
+import os  # In order to create random payloads
+import drtp  # The codec of the DRTP library
+
+###################
+# ARGUMENT PARSER #
+###################
+
+parser = argparse.ArgumentParser(
+    prog='DRTP codec benchmark',
+    description='Measures the ns per packet of building, sending and parsing DRTP packets')
+
+parser.add_argument('-n', '--number', type=int, default=200_000, help='number of packets per measurement')
+parser.add_argument('-b', '--blocks', type=int, default=2, help='selective ack blocks in the measured SR ack')
+
+args = parser.parse_args()  # Start the argument parser and its arguments
+
+################
+# MAIN PROGRAM #
+################
+
+# Packets are sent to a socket that is never read, so the kernel drops them once its buffer is full
+receiver_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+receiver_socket.bind(('127.0.0.1', 0))
+receiver_address = receiver_socket.getsockname()
+sender_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+payload = memoryview(os.urandom(drtp.chunk_size))  # A chunk, as the ChunkSource hands it out
+packet = drtp.create_packet(5, 0, 0, 0, payload)
+blocks = [(10 + 3 * i, 11 + 3 * i) for i in range(args.blocks)]
+flat_blocks = [i for block in blocks for i in block]  # As the SR session keeps them
+header = bytearray(12)  # Reusable header buffer for sendmsg
+io = drtp.DatagramIO(sender_socket, 'mmsg')
+checked_packet = memoryview(drtp.checked_struct.pack(5, 0, 0, 0, drtp.segment_crc(5, payload)) + payload)
+digest = drtp.SegmentDigest()
+
+
+# Helper functions #
+# The code before the precompiled codec, kept here to compare with
+def old_create_packet(seq, ack, flags, win, data):
+    return pack(drtp.header_format, seq, ack, flags, win) + data
+
+
+def old_parse_header(msg):
+    return unpack(drtp.header_format, msg[:12])
+
+
+def old_create_ack(seq, ack, blocks):
+    body = b''.join(pack(drtp.sack_format, first, last) for first, last in blocks)
+    return old_create_packet(seq, ack, 4, 0, body)
+
+
+def verify(msg):
+    # The receive path of a checked transfer: the CRC32 of the segment, and the digest as it is delivered
+    body = msg[12:]
+    if drtp.crc_struct.unpack_from(body)[0] == drtp.segment_crc(5, body[4:]):
+        digest.update(body[4:])
+
+
+def send_mmsg():
+    # One packet of a batch of io_batch packets sent with sendmmsg
+    for i in range(drtp.io_batch):
+        io.send_data(5, payload, receiver_address)
+    io.flush()
+
+
+# Each measurement: (name, before, after)
+measurements = [
+    ('build data packet', lambda: old_create_packet(5, 0, 0, 0, payload),
+     lambda: drtp.header_struct.pack(5, 0, 0, 0) + payload),
+    ('parse header', lambda: old_parse_header(packet), lambda: drtp.parse_header(packet)),
+    (f'build ack ({args.blocks} sack blocks)', lambda: old_create_ack(5, 4, blocks),
+     lambda: drtp.create_ack(5, 4, flat_blocks)),
+    ('send data: sendto(header + payload)',
+     lambda: sender_socket.sendto(old_create_packet(5, 0, 0, 0, payload), receiver_address),
+     lambda: sender_socket.sendto(drtp.header_struct.pack(5, 0, 0, 0) + payload, receiver_address)),
+    ('send data: sendmsg([header, payload])',
+     lambda: sender_socket.sendto(old_create_packet(5, 0, 0, 0, payload), receiver_address),
+     lambda: (drtp.header_struct.pack_into(header, 0, 5, 0, 0, 0),
+              sender_socket.sendmsg((header, payload), (), 0, receiver_address))),
+]
+
+print(f"{'ns per packet':40} {'before':>10} {'after':>10}")
+for name, before, after in measurements:
+    before_ns = timeit.timeit(before, number=args.number) / args.number * 1e9
+    after_ns = timeit.timeit(after, number=args.number) / args.number * 1e9
+    print(f"{name:40} {before_ns:10.0f} {after_ns:10.0f}")
+
+# The cost of a checked transfer (see DRTPSender.checksum) on both sides of a packet
+checksums = [
+    ('build data packet', lambda: drtp.header_struct.pack(5, 0, 0, 0) + payload,
+     lambda: drtp.checked_struct.pack(5, 0, 0, 0, drtp.segment_crc(5, payload)) + payload),
+    ('receive data packet (CRC32 and digest)', lambda: memoryview(packet)[12:], lambda: verify(checked_packet)),
+]
+print(f"\n{'ns per packet':40} {'unchecked':>10} {'checked':>10}")
+for name, unchecked, checked in checksums:
+    unchecked_ns = timeit.timeit(unchecked, number=args.number) / args.number * 1e9
+    checked_ns = timeit.timeit(checked, number=args.number) / args.number * 1e9
+    print(f"{name:40} {unchecked_ns:10.0f} {checked_ns:10.0f}")
+
+# The mmsg path packs the header straight into the next send slot, in batches of io_batch packets. The blocks
+# of the digest are hashed first, so its thread does not compete with the measurement for the GIL
+digest.digest()
+if io.mode == 'mmsg':
+    batches = max(1, args.number // drtp.io_batch)
+    mmsg_ns = timeit.timeit(send_mmsg, number=batches) / (batches * drtp.io_batch) * 1e9
+    print(f"{'send data: sendmmsg (pack_into slot)':40} {'':>10} {mmsg_ns:10.0f}")
+
+sender_socket.close()
+receiver_socket.close()
@@ -0,0 +1,186 @@
+import argparse  # In order to utilize arguments
+import itertools  # In order to run every combination of the conditions
+import multiprocessing  # In order to run the server and the proxy in processes of their own
+import contextlib  # In order to silence the client
+import tempfile  # In order to keep the test files and the received files
+import random  # In order to create the seeded test files
+import socket  # Import of socket module
+import queue  # In order to wait for the results of the server
+import json  # In order to write the results as JSON
+import csv  # In order to write the results as CSV
+import sys  # In order to silence the server and the proxy
+import os  # In order to handle the files
+from drtp import DRTPSender, DRTPReceiver  # The DRTP library doing the transfers
+from impair import ImpairmentProxy  # The impaired link between the client and the server
+
+###################
+# ARGUMENT PARSER #
+###################
+
+parser = argparse.ArgumentParser(
+    prog='DRTP transfer benchmark',
+    description='Runs DRTP transfers through the impairment proxy for every combination of the conditions')
+
+parser.add_argument('-r', '--reliability', nargs='+', choices=['stop-and-wait', 'GBN', 'SR'],
+                    default=['stop-and-wait', 'GBN', 'SR'], help='reliability functions to run')
+parser.add_argument('--sizes', nargs='+', type=int, default=[100_000, 1_000_000], help='file sizes in bytes')
+parser.add_argument('--loss', nargs='+', type=float, default=[0, 1, 5], help='packets dropped in percent')
+parser.add_argument('--delay', nargs='+', type=float, default=[0, 5], help='one-way delay in ms')
+parser.add_argument('--jitter', type=float, default=0, help='the delay varies by up to this many ms')
+parser.add_argument('--reorder', type=float, default=0, help='packets held back behind the next ones in percent')
+parser.add_argument('--duplicate', type=float, default=0, help='packets sent twice in percent')
+parser.add_argument('--corrupt', type=float, default=0, help='data packets with a bit flipped in percent')
+parser.add_argument('--bandwidth', type=float, default=0, help='link rate in Mbps (0 for no limit)')
+parser.add_argument('--limit', type=int, default=0,
+                    help='packets queued for the bandwidth before the next one is dropped (0 for no limit)')
+parser.add_argument('-w', '--window', type=int, default=64, help='window size in packets for GBN and SR')
+parser.add_argument('--cc', choices=['none', 'reno', 'cubic'], default='none', help='congestion control')
+parser.add_argument('--io', choices=['single', 'batch', 'mmsg'], default='single', help='datagram I/O')
+parser.add_argument('--mss', type=int, default=1460, help='segment size in bytes')
+parser.add_argument('--compress', choices=['zlib', 'lzma'], help='compress the files in blocks')
+parser.add_argument('--level', type=int, help='compression level (the default of the method if not given)')
+parser.add_argument('--text', action='store_true', help='make the test files of words instead of random bytes')
+parser.add_argument('--checksum', action='store_true',
+                    help='send a CRC32 with every segment and a digest of the file in the FIN')
+parser.add_argument('--repeat', type=int, default=1, help='runs of every combination')
+parser.add_argument('--seed', type=int, default=1, help='seed of the test files and of the proxy')
+parser.add_argument('--timeout', type=float, default=120, help='longest time in seconds a run may take')
+parser.add_argument('--csv', type=str, help='file the results are written to as CSV')
+parser.add_argument('--json', type=str, help='file the results are written to as JSON')
+
+args = parser.parse_args()  # Start the argument parser and its arguments
+
+
+#############
+# FUNCTIONS #
+#############
+
+# A function that receives one file in a process of its own, and puts the byte count (or the error) in results
+def run_server(sock, reliability, output, results):
+    sys.stdout = open(os.devnull, 'w')
+    with DRTPReceiver(sock.getsockname(), reliability, args.window, io_mode=args.io, mss=args.mss,
+                      sock=sock) as receiver:
+        try:
+            results.put(receiver.receive_to(output))
+        except (TimeoutError, OSError) as e:
+            results.put(str(e))
+
+
+# A function that runs the proxy in a process of its own until stop is set, and puts its stats in results
+def run_proxy(proxy, stop, results):
+    sys.stdout = open(os.devnull, 'w')
+    proxy.serve(stop)
+    results.put(proxy.stats)
+
+
+# A function that sends the file through the proxy, and returns the row of results of the run
+def run(context, reliability, filename, size, loss, delay, repeat, seed):
+    row = dict(reliability=reliability, size=size, loss=loss, delay=delay, jitter=args.jitter,
+               reorder=args.reorder, duplicate=args.duplicate, bandwidth=args.bandwidth, repeat=repeat,
+               ok=False, elapsed_ms=0, throughput_mbps=0, goodput_mbps=0, data_packets=0, retransmissions=0,
+               dropped=0, corrupted=0, error='')
+    output = filename + '.recv'
+
+    # The server and the proxy bind ports of their own, and are handed over to the processes
+    server_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    server_socket.bind(('127.0.0.1', 0))
+    proxy = ImpairmentProxy(('127.0.0.1', 0), server_socket.getsockname(), loss, delay / 1000, args.jitter / 1000,
+                            args.reorder, duplicate=args.duplicate, bandwidth=args.bandwidth * 1_000_000,
+                            limit=args.limit, seed=seed, corrupt=args.corrupt)
+    server_results = context.Queue()
+    proxy_results = context.Queue()
+    stop = context.Event()
+    server = context.Process(target=run_server, args=(server_socket, reliability, output, server_results))
+    proxy_process = context.Process(target=run_proxy, args=(proxy, stop, proxy_results))
+    server.start()
+    proxy_process.start()
+    server_socket.close()
+
+    try:
+        with DRTPSender(proxy.address, reliability, args.window, args.cc, io_mode=args.io, mss=args.mss,
+                        compression=args.compress, level=args.level, checksum=args.checksum) as sender:
+            with contextlib.redirect_stdout(open(os.devnull, 'w')):
+                data_size, lapsed_time = sender.send_file(filename)
+        row['elapsed_ms'] = round(lapsed_time, 2)
+        row['goodput_mbps'] = round(data_size * 8 / lapsed_time / 1000, 2)
+    except (TimeoutError, OSError) as e:
+        row['error'] = str(e)
+    proxy.close()
+
+    # The server is done once the FIN is acked, or when it times out
+    try:
+        received = server_results.get(timeout=args.timeout)
+        if isinstance(received, str):
+            row['error'] = row['error'] or received
+    except queue.Empty:
+        row['error'] = row['error'] or 'the server did not finish'
+    stop.set()
+    stats = proxy_results.get(timeout=args.timeout)
+    server.join(1)
+    proxy_process.join(1)
+    for process in (server, proxy_process):
+        if process.is_alive():
+            process.terminate()
+
+    # The throughput counts every byte the client sent (headers and retransmissions too), the goodput only the file
+    if row['elapsed_ms']:
+        row['throughput_mbps'] = round(stats['up']['bytes'] * 8 / row['elapsed_ms'] / 1000, 2)
+    row['data_packets'] = stats['up']['data_packets']
+    row['retransmissions'] = stats['up']['retransmissions']
+    row['dropped'] = stats['up']['dropped'] + stats['down']['dropped']
+    row['corrupted'] = stats['up']['corrupted']
+    if os.path.exists(output):
+        with open(filename, 'rb') as sent, open(output, 'rb') as received:
+            row['ok'] = not row['error'] and sent.read() == received.read()
+        os.remove(output)
+    return row
+
+
+################
+# MAIN PROGRAM #
+################
+
+# Forked processes start at once, and do not run this program again
+if 'fork' in multiprocessing.get_all_start_methods():
+    context = multiprocessing.get_context('fork')
+else:
+    context = multiprocessing.get_context()
+
+rows = []
+columns = ['reliability', 'size', 'loss', 'delay', 'ok', 'elapsed_ms', 'throughput_mbps', 'goodput_mbps',
+           'data_packets', 'retransmissions', 'dropped']
+print(' '.join(f"{column:>15}" for column in columns))
+
+with tempfile.TemporaryDirectory() as directory:
+    # The test files are random, from the seed, so every run sends the same data. Random bytes do not
+    # compress, and random words do
+    generator = random.Random(args.seed)
+    words = [bytes(generator.choices(b'abcdefghijklmnopqrstuvwxyz', k=generator.randint(2, 9))) + b' '
+             for i in range(1000)]
+    files = {}
+    for size in args.sizes:
+        files[size] = os.path.join(directory, f'{size}.bin')
+        with open(files[size], 'wb') as f:
+            if args.text:
+                data = b''.join(generator.choices(words, k=size // 4))
+                f.write((data * (size // len(data) + 1))[:size])
+            else:
+                f.write(generator.randbytes(size))
+
+    combinations = itertools.product(args.reliability, args.sizes, args.loss, args.delay, range(args.repeat))
+    for i, (reliability, size, loss, delay, repeat) in enumerate(combinations):
+        row = run(context, reliability, files[size], size, loss, delay, repeat, args.seed + i)
+        rows.append(row)
+        print(' '.join(f"{str(row[column]):>15}" for column in columns) + (f"  {row['error']}" if row['error'] else ''))
+
+# Writes the results
+if args.csv:
+    with open(args.csv, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=list(rows[0]))
+        writer.writeheader()
+        writer.writerows(rows)
+    print(f"Results written to {args.csv}")
+if args.json:
+    with open(args.json, 'w') as f:
+        json.dump(rows, f, indent=2)
+    print(f"Results written to {args.json}")
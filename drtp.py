@@ -0,0 +1,3206 @@
+# DRTP (DATA2410 Reliable Transport Protocol) on top of UDP
+# The library side of application.py: DRTPSender sends files and bytes to a DRTPReceiver,
+# with stop-and-wait, Go-Back-N (GBN) or Selective-Repeat (SR) as the reliability function
+#
+#   with DRTPReceiver(('127.0.0.1', 8088), 'SR', window=64) as receiver:
+#       receiver.receive_to('safi-recv.jpg')
+#
+#   with DRTPSender(('127.0.0.1', 8088), 'SR', window=64) as sender:
+#       data_size, lapsed_time = sender.send_file('safi.jpg')
+
+from struct import *  # To pack and unpack
+import socket  # Import of socket module
+import sys  # In order to tell the system for the options of path MTU discovery
+import time  # In order to utilize time
+import mmap  # In order to map files into memory lazily
+import os  # In order to read file sizes and release mapped pages
+import heapq  # In order to keep the retransmission timers ordered by deadline
+import asyncio  # In order to run the client and the server on an event loop
+import select  # In order to wait for a batch of datagrams
+import ctypes  # In order to call sendmmsg and recvmmsg
+import errno  # In order to check the errors of sendmmsg and recvmmsg
+import multiprocessing  # In order to send the streams of a parallel transfer from processes of their own
+import queue  # In order to wait for the stats of the server workers
+import logging  # In order to report the transfers, and the packets when asked to
+import bisect  # In order to put the rtt samples in the buckets of the histogram, and to keep the SACK runs sorted
+import hashlib  # In order to identify the data of a resumable transfer
+import json  # In order to keep the checkpoints of resumable transfers
+import collections  # In order to keep the blocks of the cache in the order they were used
+import concurrent.futures  # In order to compress the blocks ahead of the window
+import threading  # In order to keep the index of the block cache consistent while blocks are stored
+import zlib  # In order to compress the blocks, and to tell the incompressible ones
+import lzma  # In order to compress the blocks with LZMA when asked to
+
+# GLOBAL VARIABLES #
+header_format = '!IIHH'
+rtt = 0.125  # Default rtt (sets time-outs to 500 ms)
+chunk_size = 1460  # Size of the application data in each packet, unless a larger one is negotiated
+max_mss = 65507 - 12  # Largest segment size: the largest UDP payload over IPv4, less the header
+release_interval = 1 << 20  # Mapped pages are given back to the kernel every 1 MiB
+preallocate_step = 16 << 20  # Disk space for the output file is reserved 16 MiB at a time
+min_rto = 0.01  # Lower bound of the retransmission timeout (10 ms)
+max_retries = 6  # Number of times the SYN and the FIN are resent before giving up
+min_wait = 1e-6  # Shortest socket timeout, since a timeout of 0 would make the socket non-blocking
+idle_timeout = 5  # Seconds the server waits for a packet before giving up (and the client for an ack)
+# Upper bound of the retransmission timeout (1 s): a backed-off sender retransmits at least every fifth of the
+# idle timeout, so the connection survives an outage of up to 4 s before either side gives it up
+max_rto = idle_timeout / 5
+# Seconds a server that stops after its first transfer keeps answering a resent FIN, in case its FIN ACK was
+# lost: the client resends the FIN at least once per max_rto, so this covers two lost FIN ACKs
+time_wait = 2 * max_rto
+dupack_threshold = 3  # Duplicate acks that trigger a fast retransmit
+initial_cwnd = 4  # Congestion window in packets at the start of the transfer
+sack_format = '!II'  # A selective ack block: first and last sequence of a range held by the server
+max_sack_blocks = 16  # Number of selective ack blocks sent in an ack at most
+ack_size = 12 + 8 * max_sack_blocks  # Largest ack message (header and selective ack blocks)
+io_batch = 64  # Datagrams sent or received with one sendmmsg/recvmmsg call (or one drain) at most
+pace_burst = 4  # Packets that may leave back-to-back when the sender is paced
+header_struct = Struct(header_format)  # The header format compiled once, instead of on every packet
+sack_struct = Struct(sack_format)
+# An ack with n selective ack blocks is packed in one call with ack_structs[n]
+ack_structs = [Struct(header_format + sack_format[1:] * n) for n in range(max_sack_blocks + 1)]
+mss_struct = Struct('!I')  # The segment size proposed in the SYN and chosen in the SYN ACK
+# A stream of a parallel transfer: transfer id, offset of its byte range and size of the whole file, sent
+# after the segment size in the SYN. A transfer id of 0 (or a SYN without it) is an ordinary transfer
+stream_struct = Struct('!IQQ')
+# The id of the data of a resumable transfer, sent after the stream in the SYN (the stream is then sent
+# even for an ordinary transfer, as zeros). The SYN ACK answers with the bytes the receiver already holds
+resume_struct = Struct('!Q')
+checkpoint_interval = 1  # Seconds between two checkpoints of a resumable transfer
+# The blocks of a deduplicated transfer: the block size and the size of the file, sent after the file id in
+# the SYN and followed by the hash of every block. The SYN ACK answers with a bitmap of the blocks to send
+manifest_struct = Struct('!IQ')
+block_hash_size = 16  # Bytes of the BLAKE2b hash of a block
+dedup_block = 64 << 10  # Smallest block of a deduplicated transfer (64 KiB)
+max_blocks = 1024  # Blocks in a manifest at most, so it fits in the SYN. Larger files get larger blocks
+max_syn = (12 + mss_struct.size + stream_struct.size + resume_struct.size + manifest_struct.size
+           + block_hash_size * max_blocks)  # Largest SYN, with a full manifest
+cache_limit = 1 << 30  # Bytes kept in the block cache of a receiver by default (1 GiB)
+max_file_size = 1 << 40  # Largest file a parallel transfer may announce in its SYN (1 TiB)
+# A SYN with this flag asks for a compressed transfer, and a SYN ACK with it accepts. The data is then sent
+# as frames of a kind (0 for a block sent as it is, or the method in frame_kinds), the size of the payload
+# and the size of the block
+compress_flag = 1 << 4
+frame_struct = Struct('!BII')
+frame_kinds = {'zlib': 1, 'lzma': 2}
+compress_block = 128 << 10  # Bytes of the file in a frame (128 KiB)
+compress_probe = 4 << 10  # Bytes of a block compressed first, to tell whether it is worth compressing
+compress_ratio = 0.9  # A block that does not shrink below this ratio is sent as it is
+compress_workers = min(4, os.cpu_count() or 1)  # Threads compressing the blocks of a transfer
+# A SYN with this flag asks for a checked transfer, and a SYN ACK with it accepts. Every data packet then
+# has the CRC32 of its segment after the header, and the FIN the digest of all the segments
+checksum_flag = 1 << 5
+crc_struct = Struct('!I')
+checked_struct = Struct(header_format + 'I')  # Header and CRC32 of a data packet of a checked transfer
+# An ACK of the FIN with this flag tells the client that the receiver rejects the data (its digest did not match,
+# or a frame could not be decompressed)
+reject_flag = 1 << 6
+digest_size = 16  # Bytes of the BLAKE2b digest of the segments, sent in the FIN
+digest_block = 64 << 10  # The segments are hashed 64 KiB at a time, off the thread of the transfer
+# Upper bounds in ms of the buckets of the RTT histogram. Samples above the last one go in a bucket of their own
+rtt_buckets = [0.1, 0.2, 0.5, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000]
+timeline_step = 0.01  # The congestion window is sampled every 10 ms at first
+timeline_points = 1000  # Samples of the congestion window kept, every other one is dropped beyond them
+
+# Progress is logged at INFO and every packet at DEBUG. The arguments are only formatted when the level is
+# enabled, so a quiet transfer does no formatting on the hot path
+logger = logging.getLogger('drtp')
+
+
+#############
+# FUNCTIONS #
+#############
+
+# Helper functions #
+# A function which creates a packet (data and header - 1472 bytes)
+def create_packet(seq, ack, flags, win, data):
+    # creates a packet with header information and application data
+    # the input arguments are sequence number, acknowledgment number
+    # flags (we only use 4 bits),  receiver window and application data
+    # header_struct.pack returns a bytes object containing the header values
+    # packed according to the header_format !IIHH
+    header = header_struct.pack(seq, ack, flags, win)
+
+    # once we create a header, we add the application data to create a packet
+    # of 1472 bytes
+    packet = header + data
+    # print(f'packet containing header + data of size {len(packet)}')  # to show the length of the packet
+    return packet
+
+
+# A function which creates a SYN that proposes a segment size of mss bytes, for the stream
+# (transfer id, offset, size) of a parallel transfer if one is given, and asks to resume the transfer
+# of the data with file_id (see source_id) if it is not 0, or to only send the blocks of the manifest
+# (see create_manifest) that the receiver does not have. With compress the data is asked to be sent
+# compressed (see CompressedSource), and with checksum with a CRC32 in every data packet (see segment_crc)
+def create_syn(mss, stream=None, file_id=0, manifest=None, compress=False, checksum=False):
+    # A SYN for a segment size above the default is padded to a full segment, so it is also a probe of the
+    # path MTU: if it is too large to be sent or gets lost on the way, the next SYN proposes a smaller one
+    body = mss_struct.pack(mss)
+    if stream is not None or file_id or manifest is not None:
+        body += stream_struct.pack(*(stream or (0, 0, 0)))
+    if file_id or manifest is not None:
+        body += resume_struct.pack(file_id)
+    if manifest is not None:
+        block, size, hashes = manifest
+        body += manifest_struct.pack(block, size) + b''.join(hashes)
+    if mss > chunk_size:
+        body = body.ljust(mss, b'\0')
+    flags = 8 | (compress_flag if compress else 0) | (checksum_flag if checksum else 0)
+    return create_packet(0, 0, flags, 0, body)  # 1 0 0 0  SYN flag
+
+
+# A function that parses the body of a SYN, and returns the proposed segment size, the stream, the file id
+# and the manifest
+def parse_syn(msg):
+    # An older client sends no segment size, and uses the default. The stream is (0, 0, 0) for an
+    # ordinary transfer, the file id 0 for a transfer that is not resumable, and the manifest None for a
+    # transfer that is not deduplicated (or whose manifest did not arrive whole)
+    mss = mss_struct.unpack_from(msg, 12)[0] if len(msg) >= 16 else chunk_size
+    stream = stream_struct.unpack_from(msg, 16) if len(msg) >= 16 + stream_struct.size else (0, 0, 0)
+    offset = 16 + stream_struct.size
+    file_id = resume_struct.unpack_from(msg, offset)[0] if len(msg) >= offset + resume_struct.size else 0
+    offset += resume_struct.size
+    manifest = None
+    if len(msg) >= offset + manifest_struct.size:
+        block, size = manifest_struct.unpack_from(msg, offset)
+        offset += manifest_struct.size
+        count = -(-size // block) if block else 0
+        if block and len(msg) >= offset + block_hash_size * count:
+            hashes = [bytes(msg[offset + block_hash_size * i:offset + block_hash_size * (i + 1)])
+                      for i in range(count)]
+            manifest = block, size, hashes
+    return mss, stream, file_id, manifest
+
+
+# A function that parses the body of a SYN ACK, and returns the segment size chosen by the server, the
+# bytes it already holds of a resumable transfer, and the bitmap of the blocks it needs of a deduplicated
+# transfer (None if it does not deduplicate)
+def parse_syn_ack(msg):
+    # An older server sends no segment size (the default is used), does not resume and does not deduplicate
+    mss = mss_struct.unpack_from(msg, 12)[0] if len(msg) >= 16 else chunk_size
+    held = resume_struct.unpack_from(msg, 16)[0] if len(msg) >= 16 + resume_struct.size else 0
+    bitmap = msg[16 + resume_struct.size:] if len(msg) > 16 + resume_struct.size else None
+    return mss, held, bitmap
+
+
+# A function that returns the hash a block is known by in a manifest and in the block cache
+def block_hash(data):
+    return hashlib.blake2b(data, digest_size=block_hash_size).digest()
+
+
+# A function that returns the manifest of a file name or a bytes-like object: the block size, the size
+# and the hash of every block. The blocks are 64 KiB, or larger for files that would have more than
+# max_blocks of them
+def create_manifest(source):
+    with ChunkSource(source) as data:
+        size = data.size
+    block = dedup_block
+    while -(-size // block) > max_blocks:
+        block *= 2
+    with ChunkSource(source, block) as data:
+        hashes = [block_hash(data[i]) for i in range(len(data))]
+    return block, size, hashes
+
+
+# A function that returns the byte ranges of the blocks a receiver asked for in the bitmap of its SYN ACK,
+# where blocks next to each other make one range
+def needed_ranges(manifest, bitmap):
+    block, size, hashes = manifest
+    ranges = []
+    for i in range(len(hashes)):
+        if bitmap[i >> 3] & (0x80 >> (i & 7)):
+            start = i * block
+            length = min(block, size - start)
+            if ranges and sum(ranges[-1]) == start:
+                ranges[-1] = (ranges[-1][0], ranges[-1][1] + length)
+            else:
+                ranges.append((start, length))
+    return ranges
+
+
+# A function that compresses a block of a compressed transfer with method ('zlib' or 'lzma') at level (the
+# default of the method for None), and returns its frame. A block whose start does not shrink at the
+# fastest zlib level, like the blocks of a JPEG, is sent as it is without compressing the rest of it
+def compress_frame(block, method, level=None):
+    kind = frame_kinds[method]
+    probe = block[:compress_probe]
+    if len(zlib.compress(probe, 1)) > len(probe) * compress_ratio:
+        kind = 0
+    elif method == 'zlib':
+        payload = zlib.compress(block, -1 if level is None else level)
+    else:
+        payload = lzma.compress(block, preset=level, check=lzma.CHECK_NONE)
+    if kind and len(payload) > len(block) * compress_ratio:
+        kind = 0
+    if not kind:
+        payload = block
+    return frame_struct.pack(kind, len(payload), len(block)) + payload
+
+
+# A function that returns the block of a frame of a compressed transfer, or raises ValueError if it can not
+# be decompressed to the size the frame gives
+def decompress_frame(kind, payload, size):
+    if kind == 0:
+        block = payload
+    elif kind == 1:
+        block = zlib.decompressobj().decompress(payload, size)
+    elif kind == 2:
+        block = lzma.LZMADecompressor().decompress(payload, size)
+    else:
+        raise ValueError(f'unknown frame kind {kind}')
+    if len(block) != size:
+        raise ValueError(f'frame of {size} bytes decompressed to {len(block)} bytes')
+    return block
+
+
+# A function that returns the CRC32 of a segment of a checked transfer. The sequence is the initial value,
+# so a segment whose sequence got corrupted does not match either
+def segment_crc(seq, payload):
+    return zlib.crc32(payload, seq)
+
+
+# A class that hashes the segments of a checked transfer in order, for the digest in the FIN. The sender
+# hashes the segments as they are first sent, and the receiver as they are delivered to the writer
+# The segments are only copied into a block on the way, and the blocks are hashed by a thread of their own:
+# hashlib releases the GIL while it hashes more than 2 KiB, so the hashing runs next to the transfer
+class SegmentDigest:
+    def __init__(self):
+        self.hash = hashlib.blake2b(digest_size=digest_size)
+        self.count = 0  # Segments hashed
+        self.block = bytearray()  # Segments waiting to be hashed
+        self.pool = concurrent.futures.ThreadPoolExecutor(1)  # One thread, so the blocks are hashed in order
+        self.result = None
+
+    def update(self, payload):
+        self.block += payload
+        self.count += 1
+        if len(self.block) >= digest_block:
+            self.pool.submit(self.hash.update, self.block)
+            self.block = bytearray()
+
+    def through(self, data, sequence):
+        # Hashes the segments of the data up to #sequence (1-indexed) that have not been hashed yet
+        while self.count < sequence:
+            self.update(data[self.count])
+
+    def digest(self):
+        # Waits for the blocks that are being hashed, and returns the digest of all the segments
+        if self.result is None:
+            self.pool.submit(self.hash.update, self.block)
+            self.pool.shutdown(wait=True)
+            self.result = self.hash.digest()
+        return self.result
+
+    def close(self):
+        self.pool.shutdown(wait=False, cancel_futures=True)
+
+
+# A function that identifies the data of a resumable transfer with a 64 bit id (never 0): a file by its
+# name, size and modification time, so a changed file is sent again from the start, and a bytes-like
+# object by its content
+def source_id(source):
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        digest = hashlib.blake2b(source, digest_size=8)
+    else:
+        info = os.stat(source)
+        name = f'{os.path.basename(source)}:{info.st_size}:{info.st_mtime_ns}'
+        digest = hashlib.blake2b(name.encode(), digest_size=8)
+    return int.from_bytes(digest.digest(), 'big') or 1
+
+
+# A function that names the checkpoint of a resumable transfer written to output, from the offset start
+# of the byte range of a stream (None for an ordinary transfer)
+def checkpoint_name(output, start):
+    return f'{output}.resume' if start is None else f'{output}.{start}.resume'
+
+
+# A function that reads a checkpoint, and returns None if there is none or it can not be read
+def load_checkpoint(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+# A function that writes a checkpoint. It is written next to it first and then renamed, so a crash
+# never leaves half a checkpoint behind
+def save_checkpoint(path, checkpoint):
+    with open(path + '.tmp', 'w') as f:
+        json.dump(checkpoint, f)
+    os.replace(path + '.tmp', path)
+
+
+# A function that returns the (transfer id, start, size) sent in the SYN of a stream
+# (transfer id, start, length, size), or None for an ordinary transfer
+def syn_stream(stream):
+    if stream is None:
+        return None
+    transfer_id, start, length, size = stream
+    return transfer_id, start, size
+
+
+# A function that returns the segment size to propose after a SYN of mss bytes failed the probe
+def smaller_mss(mss):
+    # Halves it, but never below the default chunk size, which every path is expected to carry
+    return min(mss, max(chunk_size, mss // 2))
+
+
+# A function that sets the don't-fragment bit on the datagrams of a socket, so a SYN that is too large for the
+# known path MTU fails with EMSGSIZE instead of being fragmented. The socket module does not export the option,
+# so the values of Linux (linux/in.h) are used there
+def set_dont_fragment(sock):
+    option = getattr(socket, 'IP_MTU_DISCOVER', 10 if sys.platform.startswith('linux') else None)
+    if option is not None:
+        sock.setsockopt(socket.IPPROTO_IP, option, getattr(socket, 'IP_PMTUDISC_DO', 2))
+
+
+# A function that parses/unpacks a header
+def parse_header(header):
+    # taks a header of 12 bytes (or a whole message, starting with the header) as an argument,
+    # unpacks the value based on the specified header_format
+    # and return a tuple with the values
+    header_from_msg = header_struct.unpack_from(header)
+    # parse_flags(flags)
+    return header_from_msg
+
+
+# A function that creates an ack (flags 0 1 0 0), with selective ack blocks in the body
+def create_ack(seq, ack, blocks=()):
+    # blocks is a flat list [first, last, first, last, ...] of the ranges of sequences the server holds
+    # beyond the cumulative ack
+    blocks = blocks[:2 * max_sack_blocks]
+    return ack_structs[len(blocks) // 2].pack(seq, ack, 4, 0, *blocks)
+
+
+# A function that parses the selective ack blocks in the body of an ack
+def parse_sack(body):
+    return list(sack_struct.iter_unpack(body[:len(body) - len(body) % 8]))
+
+
+# A function that parses/unpacks flags
+def parse_flags(flags):
+    # we only parse the first 3 fields because we're not
+    # using rst in our implementation
+    syn = flags & (1 << 3)
+    ack = flags & (1 << 2)
+    fin = flags & (1 << 1)
+    return syn, ack, fin
+
+
+# A class that serves the chunks of a file lazily to the senders
+class ChunkSource:
+    # The file is memory-mapped, and each chunk is a memoryview slice of the mapping,
+    # so nothing is copied until the packet is created. Pages behind the window are
+    # released with release(), which keeps the RSS bounded by the window and not the file.
+    # A bytes-like object can be given instead of a file name, and is sliced the same way.
+    # With start and length only that byte range is served, for a stream of a parallel transfer, and with
+    # ranges only those (start, length) byte ranges are served one after the other, each starting with a
+    # chunk of its own, for the blocks a receiver is missing (see DRTPSender.dedup)
+    def __init__(self, source, size=chunk_size, start=0, length=None, ranges=None):
+        self.chunk_size = size
+        self.start = start  # Offset of the first chunk in the file
+        self.released = start - start % mmap.PAGESIZE  # Offset up to which the mapped pages have been released
+        self.file = None
+        self.map = None
+        self.view = None
+
+        if isinstance(source, (bytes, bytearray, memoryview)):
+            self.view = memoryview(source).cast('B')
+            total = len(self.view)
+        else:
+            self.file = open(source, 'rb')
+            total = os.fstat(self.file.fileno()).st_size
+            # Empty files and files that can not be mapped are read chunk by chunk instead
+            if total > 0:
+                try:
+                    self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+                    self.view = memoryview(self.map)
+                except (OSError, ValueError):
+                    self.map = None
+        start = min(start, total)
+        self.size = total - start if length is None else min(length, total - start)  # Bytes served
+        if self.view is not None:
+            self.view = self.view[start:start + self.size]
+        self.count = -(-self.size // size)  # Number of chunks, rounded up
+
+        self.ranges = ranges
+        self.first = []  # Index of the first chunk of each range
+        if ranges is not None:
+            self.count = 0
+            for range_start, range_length in ranges:
+                self.first.append(self.count)
+                self.count += -(-range_length // size)
+            self.size = sum(range_length for range_start, range_length in ranges)
+
+    def __len__(self):
+        return self.count
+
+    def extent(self, index):
+        # Returns the offset of chunk #index from the start, and the offset where its range ends
+        if not self.ranges:
+            return index * self.chunk_size, self.size
+        i = max(bisect.bisect_right(self.first, index) - 1, 0)
+        range_start, range_length = self.ranges[i]
+        return range_start + (index - self.first[i]) * self.chunk_size, range_start + range_length
+
+    def __getitem__(self, index):
+        # Returns chunk #index (starting at 0), like a slice of the whole file would
+        if index < 0 or index >= self.count:
+            raise IndexError('chunk index out of range')
+        if self.ranges is None:
+            offset, end = index * self.chunk_size, self.size
+        else:
+            offset, end = self.extent(index)
+        if self.view is not None:
+            return self.view[offset:min(offset + self.chunk_size, end)]
+        return os.pread(self.file.fileno(), min(self.chunk_size, end - offset), self.start + offset)
+
+    def release(self, sequence):
+        # Gives back the mapped pages before chunk #sequence (1-indexed) to the kernel
+        offset = self.start + self.extent(sequence - 1)[0]
+        if self.map is None or offset - self.released < release_interval:
+            return
+        offset -= offset % mmap.PAGESIZE
+        if hasattr(self.map, 'madvise'):
+            self.map.madvise(mmap.MADV_DONTNEED, self.released, offset - self.released)
+        self.released = offset
+
+    def close(self):
+        if self.view is not None:
+            self.view.release()
+        if self.map is not None:
+            self.map.close()
+        if self.file is not None:
+            self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+# A class that serves the segments of a compressed transfer to the senders, like ChunkSource
+# The blocks of the file (served by a ChunkSource of compress_block chunks) are compressed into frames by a
+# pool of threads, a few blocks ahead of the segments that are sent, and each frame starts a segment of
+# its own. zlib and lzma release the GIL while they compress, so the threads run next to the sender. The
+# number of segments is only known once the last block is compressed, so until then len() counts one
+# segment beyond the ones that are ready, and asking for it waits for the next frame
+class CompressedSource:
+    def __init__(self, source, size=chunk_size, method='zlib', level=None, workers=compress_workers):
+        self.source = source  # ChunkSource of the blocks
+        self.chunk_size = size
+        self.size = source.size  # Bytes of the file served
+        self.method = method
+        self.level = level
+        self.pool = concurrent.futures.ThreadPoolExecutor(workers)
+        self.lookahead = 2 * workers  # Blocks compressed ahead at most
+        self.pending = collections.deque()  # Frames being compressed, in order
+        self.submitted = 0  # Blocks handed to the pool
+        self.chunks = []  # Segments of the frames that are ready, None once they have been released
+        self.first = []  # Index of the first segment of every frame
+        self.released = 0  # Segments before this one have been released
+        self.frame_size = 0  # Bytes of the frames that are ready
+        self.bypassed = 0  # Blocks sent as they are
+        self.submit()
+
+    def submit(self):
+        while self.submitted < len(self.source) and len(self.pending) < self.lookahead:
+            self.pending.append(self.pool.submit(self.compress, self.submitted))
+            self.submitted += 1
+
+    def compress(self, index):
+        return compress_frame(self.source[index], self.method, self.level)
+
+    def collect(self, wait):
+        # Splits the frames that are ready (or the next one, if wait) into segments
+        while self.pending and (wait or self.pending[0].done()):
+            frame = memoryview(self.pending.popleft().result())
+            wait = False
+            self.first.append(len(self.chunks))
+            self.chunks.extend(frame[i:i + self.chunk_size] for i in range(0, len(frame), self.chunk_size))
+            self.frame_size += len(frame)
+            self.bypassed += frame[0] == 0
+            self.submit()
+
+    def __len__(self):
+        if self.pending and self.pending[0].done():
+            self.collect(False)
+        return len(self.chunks) + (1 if self.pending else 0)
+
+    def __getitem__(self, index):
+        # Returns segment #index (starting at 0), and waits for its frame if it is not ready
+        while index >= len(self.chunks) and self.pending:
+            self.collect(True)
+        if index < self.released or index >= len(self.chunks):
+            raise IndexError('segment index out of range')
+        return self.chunks[index]
+
+    def release(self, sequence):
+        # Drops the segments before segment #sequence (1-indexed), and the mapped pages of their blocks
+        for i in range(self.released, min(sequence - 1, len(self.chunks))):
+            self.chunks[i] = None
+        self.released = max(self.released, min(sequence - 1, len(self.chunks)))
+        block = bisect.bisect_right(self.first, sequence - 1) - 1
+        if block >= 0:
+            self.source.release(block + 1)
+
+    def close(self):
+        # The blocks being compressed are views of the mapping, so the threads are done before it is closed
+        self.pool.shutdown(wait=True, cancel_futures=True)
+        self.pending.clear()
+        self.source.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+# A function that opens the data of a transfer: the byte range from start (all of it for a length of None,
+# or the ranges) of a file name or a bytes-like object, in segments of size. With compression ('zlib' or
+# 'lzma') the data is sent compressed at level (see CompressedSource)
+def open_source(source, size, start=0, length=None, ranges=None, compression=None, level=None):
+    if compression is None:
+        return ChunkSource(source, size, start, length, ranges)
+    return CompressedSource(ChunkSource(source, compress_block, start, length, ranges), size, compression, level)
+
+
+# A function that logs how much the data of a compressed transfer was compressed
+def log_compression(data):
+    logger.info("%s bytes were sent as %s bytes of frames (%s of %s blocks were not compressed)",
+                data.size, data.frame_size, data.bypassed, len(data.first))
+
+
+# A class that writes the delivered in-order segments straight to the output file
+class ChunkWriter:
+    # Segments are kept until a batch is full and then written with a single
+    # (p)writev call, so the receiver only ever holds one batch and the SR window in memory.
+    # release is called with every segment once it has been written, so its buffer can be reused.
+    # With start the segments are written from that offset into a file that is shared with the other
+    # streams of a parallel transfer, so it is neither truncated nor preallocated here. With ranges
+    # [(start, length), ...] the segments fill those byte ranges of the file one after the other instead,
+    # like the blocks a deduplicated transfer is sent (see ReceiverSession.deduplicate)
+    def __init__(self, filename, batch=64, preallocate=False, release=None, start=None, ranges=None):
+        if ranges is not None:
+            start = ranges[0][0] if ranges else 0
+        flags = os.O_WRONLY | os.O_CREAT | (os.O_TRUNC if start is None else 0)
+        self.fd = os.open(filename, flags, 0o644)
+        self.batch = max(1, min(batch, os.sysconf('SC_IOV_MAX') if hasattr(os, 'sysconf') else 1024))
+        self.preallocate = preallocate and start is None and hasattr(os, 'posix_fallocate')
+        self.pending = []  # Segments waiting to be written
+        self.start = start or 0  # Offset of the first segment in the file
+        self.offset = self.start  # Offset of the next segment in the file
+        self.written = 0  # Bytes written
+        self.allocated = 0  # Bytes of disk space reserved so far
+        self.release = release
+        # Ranges still to be filled after the current one, and the end of the current one
+        self.ranges = collections.deque(ranges[1:]) if ranges is not None else None
+        self.end = sum(ranges[0]) if ranges else 0
+
+    def write(self, segment):
+        self.pending.append(segment)
+        if len(self.pending) >= self.batch:
+            self.flush()
+
+    def flush(self):
+        if not self.pending:
+            return
+        size = sum(len(segment) for segment in self.pending)
+
+        # Reserves the disk space ahead of the writes, so the file is not extended on every batch
+        if self.preallocate and self.offset + size > self.allocated:
+            step = max(preallocate_step, self.offset + size - self.allocated)
+            os.posix_fallocate(self.fd, self.allocated, step)
+            self.allocated += step
+
+        if self.ranges is None:
+            self.write_at(self.pending)
+        else:
+            self.write_ranges(self.pending)
+        self.written += size
+        if self.release is not None:
+            for segment in self.pending:
+                self.release(segment)
+        self.pending = []
+
+    def write_at(self, pending):
+        # Writes the segments at the offset, and moves the offset past them
+        pending = list(pending)
+        while pending:
+            if hasattr(os, 'pwritev'):
+                written = os.pwritev(self.fd, pending, self.offset)
+            else:
+                os.lseek(self.fd, self.offset, os.SEEK_SET)
+                written = os.writev(self.fd, pending)
+            self.offset += written
+
+            # Drops what was written, and keeps the rest of a partially written segment
+            while pending and written >= len(pending[0]):
+                written -= len(pending.pop(0))
+            if written:
+                pending[0] = memoryview(pending[0])[written:]
+
+    def write_ranges(self, pending):
+        # Writes the segments over the ranges, with one call per range they reach into. A segment that
+        # crosses the end of a range is split between the two
+        pieces = []
+        room = self.end - self.offset
+        for segment in pending:
+            while len(segment) > room:
+                if room:
+                    pieces.append(memoryview(segment)[:room])
+                    segment = memoryview(segment)[room:]
+                self.write_at(pieces)
+                pieces = []
+                self.offset, room = self.ranges.popleft()  # IndexError for data beyond the ranges
+                self.end = self.offset + room
+            pieces.append(segment)
+            room -= len(segment)
+        self.write_at(pieces)
+
+    def close(self, truncate=True):
+        self.flush()
+        # Removes the space that was preallocated but never used, unless the file has been handed over to
+        # another writer (see ReceiverSession.retire)
+        if truncate and self.allocated > self.offset:
+            os.ftruncate(self.fd, self.offset)
+        os.close(self.fd)
+        return self.written
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+# A class that takes the in-order segments of a compressed transfer in place of the ChunkWriter, and hands
+# the block of every frame to the writer once the frame is complete. The segments are copied, so their
+# buffers are released at once. The writer only ever gets whole blocks, so what it has written is always a
+# prefix of the data that a resumed transfer can continue from
+class FrameWriter:
+    def __init__(self, writer, release=None):
+        self.writer = writer  # ChunkWriter of the blocks
+        self.release = release
+        self.buffer = bytearray()  # Bytes of the frame that is not complete yet
+        self.error = None  # Why a frame could not be decompressed, after which nothing more is written
+
+    @property
+    def start(self):
+        return self.writer.start
+
+    @property
+    def offset(self):
+        return self.writer.offset
+
+    def write(self, segment):
+        # The blocks after a frame that could not be decompressed would land at the wrong offset, so they
+        # are dropped, and the transfer fails (see ReceiverSession.finish)
+        if self.error is None:
+            self.buffer += segment
+        if self.release is not None:
+            self.release(segment)
+        while self.error is None and len(self.buffer) >= frame_struct.size:
+            kind, length, size = frame_struct.unpack_from(self.buffer)
+            end = frame_struct.size + length
+            if len(self.buffer) < end:
+                break
+            payload = bytes(self.buffer[frame_struct.size:end])
+            del self.buffer[:end]
+            try:
+                self.writer.write(decompress_frame(kind, payload, size))
+            except (ValueError, zlib.error, lzma.LZMAError) as e:
+                self.error = str(e)
+                self.buffer.clear()
+                logger.error("A frame could not be decompressed, the rest of the data is dropped: %s", e)
+
+    def flush(self):
+        self.writer.flush()
+
+    def close(self, truncate=True):
+        return self.writer.close(truncate)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+# A class that keeps the blocks of the received files in a directory, one file per block named by its hash,
+# so a sender does not send the blocks the receiver has already (see DRTPSender.dedup). The least recently
+# used blocks are removed once the cache holds more than limit bytes. The workers of serve_workers share
+# the directory, so a block may be gone when it is read, and is then sent again. The blocks of a finished
+# transfer are hashed and stored by a thread of the cache (see store), off the loop of the server
+class BlockCache:
+    def __init__(self, directory, limit=cache_limit):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.limit = limit
+        self.blocks = collections.OrderedDict()  # Size of every block by hash, the least recently used first
+        self.size = 0  # Bytes of all the blocks
+        self.lock = threading.Lock()  # Held while the index is changed, by the server or the thread storing
+        self.pool = concurrent.futures.ThreadPoolExecutor(1)  # One thread, so the transfers are stored in order
+
+        # The blocks of an earlier run are ordered by the time they were last used
+        entries = [entry for entry in os.scandir(directory)
+                   if entry.is_file() and len(entry.name) == 2 * block_hash_size]
+        for entry in sorted(entries, key=lambda entry: entry.stat().st_mtime):
+            try:
+                digest = bytes.fromhex(entry.name)
+            except ValueError:
+                continue
+            self.blocks[digest] = entry.stat().st_size
+            self.size += self.blocks[digest]
+        self.evict()
+
+    def path(self, digest):
+        return os.path.join(self.directory, digest.hex())
+
+    def get(self, digest):
+        # Returns the block, or None if it is not in the cache. A block that is not known may have been
+        # put in the directory by another worker since the cache was loaded
+        try:
+            with open(self.path(digest), 'rb') as f:
+                data = f.read()
+            os.utime(self.path(digest))  # Keeps the order of use for the next run
+        except OSError:
+            with self.lock:
+                if digest in self.blocks:
+                    self.size -= self.blocks.pop(digest)
+            return None
+        with self.lock:
+            if digest not in self.blocks:
+                self.blocks[digest] = len(data)
+                self.size += len(data)
+            self.blocks.move_to_end(digest)
+        return data
+
+    def put(self, digest, data):
+        with self.lock:
+            if digest in self.blocks:
+                self.blocks.move_to_end(digest)
+                return
+        # Written next to it first, so a block is never read half written
+        temporary = f'{self.path(digest)}.{os.getpid()}.tmp'
+        with open(temporary, 'wb') as f:
+            f.write(data)
+        os.replace(temporary, self.path(digest))
+        with self.lock:
+            if digest not in self.blocks:
+                self.blocks[digest] = len(data)
+                self.size += len(data)
+            self.evict()
+
+    def store(self, filename, manifest, needed):
+        # Keeps the blocks #needed of the file of a finished transfer, from a thread of the cache
+        self.pool.submit(self.store_blocks, filename, manifest, needed)
+
+    def store_blocks(self, filename, manifest, needed):
+        # Reads the blocks that were sent back from the file, and keeps the ones that match their hash
+        block, size, hashes = manifest
+        try:
+            with open(filename, 'rb') as f:
+                for i in needed:
+                    data = os.pread(f.fileno(), min(block, size - i * block), i * block)
+                    if block_hash(data) == hashes[i]:
+                        self.put(hashes[i], data)
+                    else:
+                        logger.warning("Block %s of %s does not match its hash, and is not cached", i, filename)
+        except OSError as e:
+            logger.warning("The blocks of %s could not be cached: %s", filename, e)
+
+    def close(self):
+        # Waits for the blocks that are being stored
+        self.pool.shutdown(wait=True)
+
+    def evict(self):
+        # Removes the least recently used blocks until the cache fits in its limit (with the lock held)
+        while self.size > self.limit and self.blocks:
+            digest, size = self.blocks.popitem(last=False)
+            self.size -= size
+            try:
+                os.remove(self.path(digest))
+            except FileNotFoundError:
+                pass
+
+
+# A class that estimates the retransmission timeout from measured RTTs (Jacobson/Karels, RFC 6298)
+class RTOEstimator:
+    # Until the first RTT sample arrives, the timeout is 4 times the default rtt (500 ms)
+    def __init__(self, initial=4 * rtt, minimum=min_rto, maximum=max_rto):
+        self.srtt = None  # Smoothed RTT
+        self.rttvar = None  # RTT variation
+        self.minimum = minimum
+        self.maximum = maximum
+        self.timeout = initial  # Current retransmission timeout
+        self.metrics = None  # TransferMetrics of the transfer in progress, which also gets the samples
+
+    def sample(self, measured):
+        # Takes an RTT measured on a packet that was only sent once (Karn's rule)
+        if self.srtt is None:
+            self.srtt = measured
+            self.rttvar = measured / 2
+        else:
+            self.rttvar = 0.75 * self.rttvar + 0.25 * abs(self.srtt - measured)
+            self.srtt = 0.875 * self.srtt + 0.125 * measured
+        # A fresh sample also undoes any exponential backoff
+        self.timeout = min(max(self.srtt + 4 * self.rttvar, self.minimum), self.maximum)
+        if self.metrics is not None:
+            self.metrics.rtt(measured, self.srtt)
+
+    def backoff(self):
+        # Doubles the timeout after a timeout, as the path may be congested
+        self.timeout = min(self.timeout * 2, self.maximum)
+
+
+# A class that keeps the congestion window of the sender
+# The base class never limits the sender, so the negotiated window is used as is (--cc none)
+class CongestionControl:
+    name = 'none'
+
+    def __init__(self, limit):
+        self.limit = limit  # The congestion window never grows past the negotiated window
+        self.cwnd = limit  # Congestion window in packets
+        self.ssthresh = limit  # Slow start threshold in packets
+        self.recovery = None  # Last sequence sent when fast recovery started, None outside of it
+
+    def window(self):
+        # Number of packets that may be in flight
+        return max(1, int(self.cwnd))
+
+    def on_ack(self, acked, ack, srtt):
+        # Called with the number of newly acked packets and the highest acked sequence
+        pass
+
+    def on_dupack(self):
+        # Called for every duplicate ack while in fast recovery
+        pass
+
+    def on_loss(self, last_sent):
+        # Called when a loss is detected from acks (fast retransmit)
+        pass
+
+    def on_timeout(self):
+        # Called when the retransmission timer expires
+        pass
+
+
+# Reno: slow start, congestion avoidance (AIMD) and fast recovery
+class Reno(CongestionControl):
+    name = 'reno'
+
+    def __init__(self, limit):
+        super().__init__(limit)
+        self.cwnd = min(initial_cwnd, limit)
+
+    def on_ack(self, acked, ack, srtt):
+        if self.recovery is not None:
+            # Stays in fast recovery until everything sent before the loss is acked
+            if ack < self.recovery:
+                return
+            self.recovery = None
+            self.cwnd = self.ssthresh  # Deflates the window
+            return
+        if self.cwnd < self.ssthresh:
+            self.cwnd += acked  # Slow start: one packet per ack, doubles every RTT
+        else:
+            self.grow(acked, srtt)
+        self.cwnd = min(self.cwnd, self.limit)
+
+    def grow(self, acked, srtt):
+        # Congestion avoidance: one packet per RTT
+        self.cwnd += acked / self.cwnd
+
+    def on_dupack(self):
+        if self.recovery is not None:
+            self.cwnd = min(self.cwnd + 1, self.limit)  # Every dupack means a packet has left the network
+
+    def on_loss(self, last_sent):
+        if self.recovery is not None:
+            return
+        self.decrease()
+        self.cwnd = self.ssthresh + 3  # The three dupacks left the network
+        self.recovery = last_sent
+
+    def on_timeout(self):
+        self.decrease()
+        self.cwnd = 1
+        self.recovery = None
+
+    def decrease(self):
+        # Multiplicative decrease
+        self.ssthresh = max(self.cwnd / 2, 2)
+
+
+# CUBIC (RFC 8312): the window grows as a cubic function of the time since the last loss
+class Cubic(Reno):
+    name = 'cubic'
+    c = 0.4  # Scaling constant
+    beta = 0.7  # Multiplicative decrease factor
+
+    def __init__(self, limit):
+        super().__init__(limit)
+        self.w_max = 0  # Window before the last decrease
+        self.epoch = None  # Start of the current congestion avoidance period
+        self.k = 0  # Time it takes to grow back to w_max
+        self.origin = 0  # Window the cubic function plateaus at
+        self.w_est = 0  # Estimate of the window Reno would have had (TCP-friendly region)
+
+    def grow(self, acked, srtt):
+        now = time.monotonic()
+        if self.epoch is None:
+            self.epoch = now
+            self.w_est = self.cwnd
+            if self.cwnd < self.w_max:
+                self.k = ((self.w_max - self.cwnd) / self.c) ** (1 / 3)
+                self.origin = self.w_max
+            else:
+                self.k = 0
+                self.origin = self.cwnd
+
+        # Window the cubic function gives one RTT from now
+        t = now - self.epoch + (srtt or 0)
+        target = self.origin + self.c * (t - self.k) ** 3
+        # Never grows slower than Reno would
+        self.w_est += 3 * (1 - self.beta) / (1 + self.beta) * acked / self.cwnd
+        target = max(target, self.w_est)
+
+        if target > self.cwnd:
+            self.cwnd += min(target - self.cwnd, self.cwnd / 2) * acked / self.cwnd
+        else:
+            self.cwnd += 0.01 * acked / self.cwnd
+
+    def decrease(self):
+        self.epoch = None
+        # Fast convergence: releases bandwidth to new flows if the window did not reach the last w_max
+        if self.cwnd < self.w_max:
+            self.w_max = self.cwnd * (1 + self.beta) / 2
+        else:
+            self.w_max = self.cwnd
+        self.ssthresh = max(self.cwnd * self.beta, 2)
+
+    def on_loss(self, last_sent):
+        if self.recovery is not None:
+            return
+        self.decrease()
+        self.cwnd = self.ssthresh
+        self.recovery = last_sent
+
+
+# The congestion controls that can be selected with --cc
+congestion_controls = {cc.name: cc for cc in (CongestionControl, Reno, Cubic)}
+
+
+# A class that spreads the packets of the window over the RTT (token bucket)
+# Tokens are bytes that may be sent. They fill up at rate bytes per second, up to pace_burst packets, so
+# the window does not leave as one burst that overflows the queue of the bottleneck. A rate of 0 turns it off
+class Pacer:
+    def __init__(self, rate=0, auto=False, packet_size=12 + chunk_size):
+        self.rate = rate  # Bytes per second
+        self.auto = auto and not rate  # Whether the rate follows the window and the SRTT
+        self.packet_size = packet_size  # Size of a full data packet (header and segment)
+        self.burst = pace_burst * packet_size
+        self.tokens = self.burst
+        self.last = time.monotonic()  # When the tokens were last filled up
+
+    def delay(self, size=None):
+        # Seconds until a packet of size bytes (a full data packet by default) may be sent
+        if not self.rate:
+            return 0
+        size = size or self.packet_size
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+        self.last = now
+        return max(size - self.tokens, 0) / self.rate
+
+    def consume(self, size=None):
+        if self.rate:
+            self.tokens -= size or self.packet_size
+
+    def update(self, cc, srtt):
+        # With auto pacing the rate is gain * window / SRTT: twice the window per RTT in slow start,
+        # so the window can still double, and 1.25 times the window after it
+        if self.auto and srtt:
+            gain = 2 if cc.cwnd < cc.ssthresh else 1.25
+            self.rate = gain * cc.window() * self.packet_size / srtt
+
+
+# A class that holds back the acks of in-order packets (delayed acks)
+# Only every Nth in-order packet is acked at once, or the ack is sent when the delay has passed
+class DelayedAck:
+    def __init__(self, every=1, delay=0):
+        self.every = max(1, every)
+        self.delay = delay  # Seconds an ack may be held back
+        self.msg = None  # Ack that is held back
+        self.address = None  # and where it goes
+        self.count = 0  # In-order packets received since the last ack
+        self.deadline = 0  # When the held back ack has to be sent
+        self.packets = 0  # Packets received
+        self.acks = 0  # Acks sent
+
+    def ack(self, msg, address, immediate):
+        # Returns the ack if it has to be sent now, or None if it is held back
+        self.packets += 1
+        self.count += 1
+        if immediate or self.count >= self.every:
+            self.msg = None
+            self.count = 0
+            self.acks += 1
+            return msg
+        if self.msg is None:
+            self.deadline = time.monotonic() + self.delay
+        # The latest ack replaces the one held back, as the acks are cumulative
+        self.msg = msg
+        self.address = address
+        return None
+
+    def timeout(self):
+        # Seconds until the held back ack is due, or the idle timeout if there is none
+        if self.msg is None:
+            return idle_timeout
+        return max(self.deadline - time.monotonic(), min_wait)
+
+    def expire(self):
+        # Returns the held back ack and where it goes, when its delay has passed
+        msg, address = self.msg, self.address
+        self.msg = None
+        self.count = 0
+        self.acks += 1
+        return msg, address
+
+
+# sendmmsg and recvmmsg are called through ctypes, where the C library has them (Linux)
+try:
+    libc = ctypes.CDLL(None, use_errno=True)
+    libc.sendmmsg.argtypes = [ctypes.c_int, ctypes.c_void_p, ctypes.c_uint, ctypes.c_int]
+    libc.recvmmsg.argtypes = [ctypes.c_int, ctypes.c_void_p, ctypes.c_uint, ctypes.c_int, ctypes.c_void_p]
+except (OSError, AttributeError, TypeError):
+    libc = None
+
+
+# struct iovec, struct msghdr and struct mmsghdr of the C library
+class IOVec(ctypes.Structure):
+    _fields_ = [('base', ctypes.c_void_p), ('len', ctypes.c_size_t)]
+
+
+class MsgHdr(ctypes.Structure):
+    _fields_ = [('name', ctypes.c_void_p), ('namelen', ctypes.c_uint32), ('iov', ctypes.POINTER(IOVec)),
+                ('iovlen', ctypes.c_size_t), ('control', ctypes.c_void_p), ('controllen', ctypes.c_size_t),
+                ('flags', ctypes.c_int)]
+
+
+class MMsgHdr(ctypes.Structure):
+    _fields_ = [('hdr', MsgHdr), ('len', ctypes.c_uint)]
+
+
+# A class that sends and receives the datagrams of a socket, one at a time or in batches
+# 'single' makes one system call per datagram. 'batch' sends the packets of a burst together on flush(),
+# and drains every datagram that is waiting when the socket wakes up. 'mmsg' does the same with one
+# sendmmsg/recvmmsg call per io_batch datagrams, and falls back to 'batch' where they are missing
+# With slots, 'single' and 'batch' receive with recvfrom_into into a ring of preallocated buffers, and hand
+# the datagrams over as memoryviews. A buffer is only received into again once nothing refers to it: the
+# datagram is given back with recycle() when it has been handled, and a payload that is kept is marked
+# with hold() and given back with release() once it has been written
+class DatagramIO:
+    def __init__(self, sock, mode='single', size=12 + chunk_size, slots=0, send_size=12 + chunk_size):
+        if mode == 'mmsg' and libc is None:
+            mode = 'batch'
+        if mode == 'mmsg':
+            slots = 0  # recvmmsg has buffers of its own
+        self.sock = sock
+        self.mode = mode
+        self.size = size  # Largest datagram received
+        self.send_size = send_size  # Largest datagram sent with sendmmsg
+        self.pending = []  # (packet, address) waiting to be sent by flush()
+        self.names = {}  # sockaddr_in of each address, for sendmmsg
+        self.addresses = {}  # Address of each sockaddr_in, for recvmmsg
+        self.free = [bytearray(size) for i in range(slots)]  # Buffers of the ring that may be received into
+        self.ring = {id(buffer): buffer for buffer in self.free}  # All the buffers of the ring, by id
+        self.refs = {}  # Number of users of each buffer in use, by id
+        self.send_time = 0  # Seconds spent sending datagrams
+        self.recv_time = 0  # Seconds spent receiving datagrams, the waits for them included
+
+        if mode == 'mmsg':
+            # The headers point into one buffer for the datagrams and one for the addresses, in slots of
+            # a fixed size, so a call only has to copy the packets in and set their lengths and addresses
+            self.recv_msgs, self.recv_iov, self.recv_buffer = self.slots(size)
+            self.recv_names = ctypes.create_string_buffer(16 * io_batch)
+            self.send_msgs, self.send_iov, self.send_buffer = self.slots(send_size)
+            self.send_view = memoryview(self.send_buffer).cast('B')
+            self.send_to = [None] * io_batch  # Address each send slot points to
+            self.send_lengths = [send_size] * io_batch  # Length each send slot is set to
+            self.filled = 0  # Send slots in use, sent by the next flush()
+            for i in range(io_batch):
+                self.recv_msgs[i].hdr.name = ctypes.addressof(self.recv_names) + 16 * i
+                self.recv_msgs[i].hdr.namelen = 16
+                self.send_msgs[i].hdr.namelen = 16
+
+    def slots(self, size):
+        # Returns io_batch headers, with an iovec each for its own slot of size bytes in a new buffer
+        msgs = (MMsgHdr * io_batch)()
+        iov = (IOVec * io_batch)()
+        buffer = ctypes.create_string_buffer(size * io_batch)
+        for i in range(io_batch):
+            iov[i].base = ctypes.addressof(buffer) + size * i
+            iov[i].len = size
+            msgs[i].hdr.iov = ctypes.pointer(iov[i])
+            msgs[i].hdr.iovlen = 1
+        return msgs, iov, buffer
+
+    def send(self, packet, address):
+        # Sends the packet now in 'single' mode, and otherwise on the next flush()
+        if self.mode == 'single':
+            started = time.perf_counter()
+            self.sock.sendto(packet, address)
+            self.send_time += time.perf_counter() - started
+        elif self.mode == 'mmsg':
+            start = self.fill(address, len(packet))
+            self.send_view[start:start + len(packet)] = packet
+        else:
+            self.pending.append((packet, address))
+
+    def send_data(self, seq, payload, address, crc=None):
+        # Sends a data packet (ack, flags and window are 0), with the CRC32 of the segment after the header
+        # unless crc is None. With 'mmsg' the header is packed straight into the next send slot in front of
+        # the payload, and otherwise it is joined with the payload, which is cheaper in Python than a
+        # scatter/gather sendmsg([header, payload]) (see bench_codec.py)
+        if self.mode == 'mmsg':
+            size = 12 if crc is None else checked_struct.size
+            start = self.fill(address, size + len(payload))
+            if crc is None:
+                header_struct.pack_into(self.send_view, start, seq, 0, 0, 0)
+            else:
+                checked_struct.pack_into(self.send_view, start, seq, 0, 0, 0, crc)
+            self.send_view[start + size:start + size + len(payload)] = payload
+        elif crc is None:
+            self.send(header_struct.pack(seq, 0, 0, 0) + payload, address)
+        else:
+            self.send(checked_struct.pack(seq, 0, 0, 0, crc) + payload, address)
+
+    def fill(self, address, length):
+        # Takes the next send slot for a packet of length bytes to address, and returns its offset in the
+        # send buffer. The slots are sent first when they are all in use. The length and the address of a
+        # slot are only set when they change, which they seldom do within a transfer
+        i = self.filled
+        if i == io_batch:
+            self.flush()
+            i = 0
+        if self.send_lengths[i] != length:
+            self.send_lengths[i] = length
+            self.send_iov[i].len = length
+        if self.send_to[i] != address:
+            self.send_to[i] = address
+            self.send_msgs[i].hdr.name = ctypes.addressof(self.sockaddr(address))
+        self.filled = i + 1
+        return self.send_size * i
+
+    def flush(self):
+        # Sends the packets waiting since the last flush
+        if not (self.filled if self.mode == 'mmsg' else self.pending):
+            return
+        started = time.perf_counter()
+        if self.mode == 'mmsg':
+            self.sendmmsg()
+            self.filled = 0
+        else:
+            for packet, address in self.pending:
+                self.sendto(packet, address)
+            self.pending.clear()
+        self.send_time += time.perf_counter() - started
+
+    def sendto(self, packet, address):
+        # The socket is non-blocking between the batches, so a full send buffer is waited for
+        while True:
+            try:
+                return self.sock.sendto(packet, address)
+            except BlockingIOError:
+                select.select([], [self.sock], [])
+
+    def sendmmsg(self):
+        # Sends the slots in use, and the rest of them after a partial send
+        msgs = ctypes.addressof(self.send_msgs)
+        done = 0
+        while done < self.filled:
+            sent = libc.sendmmsg(self.sock.fileno(), msgs + done * ctypes.sizeof(MMsgHdr), self.filled - done, 0)
+            if sent < 0:
+                error = ctypes.get_errno()
+                if error in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    select.select([], [self.sock], [])
+                elif error != errno.EINTR:
+                    raise OSError(error, os.strerror(error))
+                continue
+            done += sent
+
+    def sockaddr(self, address):
+        # Returns the struct sockaddr_in of an (ip, port) address
+        name = self.names.get(address)
+        if name is None:
+            try:
+                host = socket.inet_aton(address[0])
+            except OSError:
+                host = socket.inet_aton(socket.gethostbyname(address[0]))  # A host name
+            name = ctypes.create_string_buffer(pack('=H', socket.AF_INET) + pack('!H', address[1]) + host, 16)
+            self.names[address] = name
+        return name
+
+    def recv(self, timeout):
+        # Waits up to timeout seconds (None waits for ever) for datagrams, and returns the list of
+        # (message, address) received. The list is empty when it timed out
+        started = time.perf_counter()
+        try:
+            return self.wait(timeout)
+        finally:
+            self.recv_time += time.perf_counter() - started
+
+    def wait(self, timeout):
+        if self.mode == 'single':
+            # Socket time-outs only have ms resolution, so shorter waits (when pacing) are done with select
+            if timeout is not None and timeout < 1e-3 and not select.select([self.sock], [], [], max(timeout, 0))[0]:
+                return []
+            self.sock.settimeout(None if timeout is None else max(timeout, min_wait))
+            try:
+                return [self.recvfrom()]
+            except socket.timeout:
+                return []
+
+        if self.sock.gettimeout() != 0:
+            self.sock.settimeout(0)
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            wait = None if deadline is None else max(deadline - time.monotonic(), 0)
+            if not select.select([self.sock], [], [], wait)[0]:
+                return []
+            received = self.recvmmsg() if self.mode == 'mmsg' else self.drain()
+            # A wake-up without a datagram (an ICMP error that was already reported) waits again
+            if received or (deadline is not None and time.monotonic() >= deadline):
+                return received
+
+    def drain(self):
+        # Receives the datagrams that are waiting, without blocking
+        received = []
+        while len(received) < io_batch:
+            try:
+                received.append(self.recvfrom())
+            except BlockingIOError:
+                break
+        return received
+
+    def recvfrom(self):
+        # Receives a datagram into a free buffer of the ring, or into a new bytes object without a ring
+        if not self.ring:
+            return self.sock.recvfrom(self.size)
+        if self.free:
+            buffer = self.free.pop()
+        else:
+            # Every buffer is in use, so the ring grows
+            buffer = bytearray(self.size)
+            self.ring[id(buffer)] = buffer
+        try:
+            length, address = self.sock.recvfrom_into(buffer)
+        except BaseException:
+            self.free.append(buffer)
+            raise
+        self.refs[id(buffer)] = 1
+        return memoryview(buffer)[:length], address
+
+    def hold(self, payload):
+        # Keeps the buffer of a payload from being received into, until release() is called with it
+        key = id(payload.obj) if isinstance(payload, memoryview) else None
+        if key in self.refs:
+            self.refs[key] += 1
+
+    def release(self, payload):
+        # Gives the buffer of a payload back to the ring when it is no longer used
+        key = id(payload.obj) if isinstance(payload, memoryview) else None
+        if key in self.refs:
+            self.refs[key] -= 1
+            if not self.refs[key]:
+                del self.refs[key]
+                self.free.append(self.ring[key])
+
+    def recycle(self, msg):
+        # Gives the buffer of a datagram that has been handled back, unless its payload is held
+        self.release(msg)
+
+    def recvmmsg(self):
+        count = libc.recvmmsg(self.sock.fileno(), self.recv_msgs, io_batch, socket.MSG_DONTWAIT, None)
+        if count < 0:
+            error = ctypes.get_errno()
+            if error in (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR):
+                return []
+            raise OSError(error, os.strerror(error))
+        view = memoryview(self.recv_buffer).cast('B')
+        names = self.recv_names.raw
+        msg_size = ctypes.sizeof(MMsgHdr)
+        length_offset = MMsgHdr.len.offset
+        received = []
+        for i in range(count):
+            length = unpack_from('I', self.recv_msgs, msg_size * i + length_offset)[0]
+            name = names[16 * i + 2:16 * i + 8]
+            address = self.addresses.get(name)
+            if address is None:
+                address = self.addresses[name] = (socket.inet_ntoa(name[2:]), unpack('!H', name[:2])[0])
+            received.append((view[self.size * i:self.size * i + length].tobytes(), address))
+        return received
+
+
+# A class that keeps the telemetry of one transfer of a sender: counters of the packets, a histogram of the
+# RTT samples, a timeline of the congestion window and the time spent in the socket calls. The counters are
+# plain attributes, so the hot path only adds to them. With report, a snapshot is handed to it every
+# interval seconds, and the final one when the transfer is done
+class TransferMetrics:
+    def __init__(self, io=None, report=None, interval=0, **info):
+        self.io = io  # DatagramIO whose socket calls are timed, None on an event loop
+        self.report = report
+        self.interval = interval
+        self.info = info  # Settings of the transfer, copied into every snapshot
+        self.sent = 0  # Data packets sent, retransmissions included
+        self.retransmissions = 0  # Data packets sent again
+        self.acks = 0  # Acks received
+        self.duplicate_acks = 0  # Acks that acked nothing new
+        self.timeouts = 0  # Expired retransmission timers
+        self.fast_retransmits = 0  # Losses found from duplicate acks
+        self.acked = 0  # Segments acked so far
+        self.checksum_time = 0  # Seconds spent on the CRC32s and the digest of a checked transfer
+        self.data_size = 0  # Bytes of the data, once the transfer is done
+        self.histogram = [0] * (len(rtt_buckets) + 1)  # RTT samples in each bucket
+        self.rtt_count = 0
+        self.rtt_sum = 0
+        self.rtt_min = None
+        self.rtt_max = None
+        self.srtt = None
+        self.timeline = []  # (ms since the start, cwnd, packets in flight, srtt in ms, rto in ms)
+        self.step = timeline_step  # Time between two samples of the timeline
+        self.started = time.monotonic()
+        self.cpu_started = time.process_time()
+        self.io_started = (io.send_time, io.recv_time) if io is not None else (0, 0)
+        self.next_sample = self.started
+        self.next_report = self.started + interval
+        self.finished = None  # When the last segment was acked
+
+    def rtt(self, measured, srtt):
+        # Takes an RTT sample and the smoothed RTT in seconds
+        self.srtt = srtt
+        ms = measured * 1000
+        self.histogram[bisect.bisect_left(rtt_buckets, ms)] += 1
+        self.rtt_count += 1
+        self.rtt_sum += ms
+        if self.rtt_min is None or ms < self.rtt_min:
+            self.rtt_min = ms
+        if self.rtt_max is None or ms > self.rtt_max:
+            self.rtt_max = ms
+
+    def tick(self, acked, in_flight, cwnd, rto):
+        # Called on every round of the sender with the segments acked so far, the segments in flight and the
+        # congestion window. Samples the timeline every step, and hands a snapshot to report every interval
+        now = time.monotonic()
+        if now < self.next_sample:
+            return
+        self.acked = acked
+        srtt = None if rto.srtt is None else round(rto.srtt * 1000, 3)
+        self.timeline.append((round((now - self.started) * 1000, 3), round(cwnd, 2), in_flight, srtt,
+                              round(rto.timeout * 1000, 3)))
+        # A long transfer keeps a coarser timeline instead of a longer one
+        if len(self.timeline) >= timeline_points:
+            del self.timeline[1::2]
+            self.step *= 2
+        self.next_sample = now + self.step
+        if self.report is not None and self.interval and now >= self.next_report:
+            self.next_report = now + self.interval
+            self.report(self.to_dict(timeline=False))
+
+    def finish(self, data_size, segments):
+        # Called once every segment has been acked. Hands the final metrics to report
+        self.finished = time.monotonic()
+        self.data_size = data_size
+        self.acked = segments
+        self.cpu_time = time.process_time() - self.cpu_started
+        if self.report is not None:
+            self.report(self.to_dict())
+
+    def to_dict(self, timeline=True):
+        # Returns the metrics as a dict that can be written as JSON, with the timeline unless timeline is False.
+        # The elapsed time is split into the time spent sending, receiving (and waiting for) datagrams, and
+        # the rest, which is the time spent in the protocol logic
+        final = self.finished is not None
+        elapsed = (self.finished if final else time.monotonic()) - self.started
+        cpu_time = self.cpu_time if final else time.process_time() - self.cpu_started
+        send_time = recv_time = 0
+        if self.io is not None:
+            send_time = self.io.send_time - self.io_started[0]
+            recv_time = self.io.recv_time - self.io_started[1]
+        buckets = {f'<={bound}': count for bound, count in zip(rtt_buckets, self.histogram)}
+        buckets[f'>{rtt_buckets[-1]}'] = self.histogram[-1]
+        metrics = dict(self.info, final=final, elapsed_ms=round(elapsed * 1000, 3), data_size=self.data_size,
+                       acked=self.acked, sent=self.sent, retransmissions=self.retransmissions, acks=self.acks,
+                       duplicate_acks=self.duplicate_acks, timeouts=self.timeouts,
+                       fast_retransmits=self.fast_retransmits,
+                       goodput_mbps=round(self.data_size * 8 / elapsed / 1e6, 3) if final and elapsed else 0,
+                       rtt=dict(samples=self.rtt_count,
+                                min_ms=None if self.rtt_min is None else round(self.rtt_min, 3),
+                                mean_ms=round(self.rtt_sum / self.rtt_count, 3) if self.rtt_count else None,
+                                max_ms=None if self.rtt_max is None else round(self.rtt_max, 3),
+                                srtt_ms=None if self.srtt is None else round(self.srtt * 1000, 3),
+                                histogram=buckets),
+                       cpu_time_ms=round(cpu_time * 1000, 3), checksum_ms=round(self.checksum_time * 1000, 3))
+        if self.io is not None:
+            metrics.update(send_ms=round(send_time * 1000, 3), recv_ms=round(recv_time * 1000, 3),
+                           logic_ms=round((elapsed - send_time - recv_time) * 1000, 3))
+        if timeline:
+            metrics['timeline'] = self.timeline
+        return metrics
+
+
+# Main functions #
+# A function that sends segment #sequence of the data to the server
+def send_segment(sender, data, sequence):
+    # Acknowledgement number, flags and window in the header are fixed and static for the client
+    if sender.digest is None:
+        sender.io.send_data(sequence, data[sequence - 1], sender.address)
+        return
+    # A checked transfer sends the CRC32 of the segment, and hashes the segments in order for the FIN
+    started = time.perf_counter()
+    payload = data[sequence - 1]
+    crc = segment_crc(sequence, payload)
+    sender.digest.through(data, sequence)
+    sender.metrics.checksum_time += time.perf_counter() - started
+    sender.io.send_data(sequence, payload, sender.address, crc)
+
+
+# A function that asks the pacer whether the next packet may be sent
+# Returns None when it may be sent now, or when it may be sent, once the burst so far has been sent.
+# The sender listens for acks until then
+def pace(sender, pacer):
+    wait = pacer.delay()
+    if not wait:
+        return None
+    sender.io.flush()
+    return time.monotonic() + wait
+
+
+# A function that gives up the transfer when a time-out finds that nothing has been acked for idle_timeout
+# seconds: by then the server has dropped the connection, and the retransmissions would go on forever
+def check_idle(last_ack):
+    if time.monotonic() - last_ack >= idle_timeout:
+        raise TimeoutError("the receiver stopped acking the data")
+
+
+# Stop-and-wait (client)
+def stop_and_wait_c(sender, data):
+    # CLIENT - sender is the DRTPSender, and data the ChunkSource of the file to be sent
+    sequence = 1  # Needed for the first sequence
+    retransmitted = False  # Karn's rule: no RTT samples from retransmitted packets
+    last_ack = time.monotonic()  # When the last packet was acked
+    metrics = sender.metrics
+
+    # Test case skip_seq
+    if sender.test == 'skip_seq':
+        skip = True  # A skip to be done
+        skip_seq = 5  # Skips packet #5
+    else:
+        skip = False
+        skip_seq = 0
+
+    # Send the content of the requested file to the server
+    while sequence <= len(data):
+        metrics.tick(sequence - 1, 1, 1, sender.rto)
+        logger.debug("\ncreating a packet #%s", sequence)
+        # Skips sequence (skip_seq) if test 1 is active
+        if skip and sequence == skip_seq:
+            skip = False  # To keep it from skipping multiple times
+            logger.debug("Packet sending skipped")
+        else:
+            # Send packet
+            send_segment(sender, data, sequence)
+            sender.io.flush()
+            metrics.sent += 1
+            if retransmitted:
+                metrics.retransmissions += 1
+        # Starts measuring RTT after sending of packet
+        sent_at = time.monotonic()
+        deadline = sent_at + sender.rto.timeout
+
+        # Listens for ack from server that the packet has been received
+        acked = False
+        while not acked:
+            acks = sender.io.recv(deadline - time.monotonic())
+            if not acks:
+                logger.debug("Timed out: ACK not received - resending packet #%s", sequence)
+                check_idle(last_ack)
+                metrics.timeouts += 1
+                sender.rto.backoff()
+                retransmitted = True
+                break
+
+            for ack_msg, address in acks:
+                seq, ack, flags, win = parse_header(ack_msg)  # the header of the ack message
+                SYN, ACK, FIN = parse_flags(flags)
+                metrics.acks += 1
+                if ACK and sequence == ack and not acked:
+                    logger.debug("Correct ACK received #%s", sequence)
+                    # Sets rtt if the packet was not retransmitted
+                    if not retransmitted:
+                        sender.rto.sample(time.monotonic() - sent_at)
+                    retransmitted = False
+                    sequence += 1
+                    data.release(sequence)  # Pages behind the window are no longer needed
+                    last_ack = time.monotonic()
+                    acked = True
+                else:
+                    logger.debug("Wrong ACK received")
+                    metrics.duplicate_acks += 1
+
+    logger.info("\nAll data sent")
+    # Returns data size for calculation of throughput value
+    return data.size
+
+
+# Go-Back-N (client)
+def gbn_c(sender, data, window):
+    # CLIENT - sender is the DRTPSender, and data the ChunkSource of the file to be sent
+    # window is the window size negotiated in the handshake
+    cc = congestion_controls[sender.cc](window)  # Limits the window to the congestion window
+    sequence = 1  # Oldest unacknowledged sequence
+    next_sequence = 1  # Next sequence to be sent
+    highest_sent = 0  # Highest sequence sent so far, as going back N lowers next_sequence
+    sent_at = {}  # Send time of each sequence in the window, for RTT samples
+    retransmitted = set()  # Karn's rule: no RTT samples from retransmitted packets
+    timer = 0  # Start of the retransmission timer of the oldest unacknowledged sequence
+    dupacks = 0  # Duplicate acks received for the oldest unacknowledged sequence
+    recover = 0  # Highest sequence sent at the last fast retransmit, which is only done once per loss
+    last_ack = time.monotonic()  # When the oldest unacknowledged sequence last moved
+    pacer = Pacer(sender.rate, sender.pace, 12 + data.chunk_size)  # Spreads the window over the RTT
+    pacer.update(cc, sender.rto.srtt)
+    metrics = sender.metrics
+
+    # Initialising for test case skip_seq
+    if sender.test == 'skip_seq':
+        skip = True  # A skip to be done
+        skip_seq = 5  # Skips packet #5
+    else:
+        skip = False
+        skip_seq = 0
+
+    # Send the content of the requested file to the server
+    while sequence <= len(data):
+        metrics.tick(sequence - 1, next_sequence - sequence, cc.cwnd, sender.rto)
+        # Fills the window, as fast as the pacer lets it
+        send_at = None  # When the pacer lets the next packet go, if it held it back
+        while next_sequence < sequence + cc.window() and next_sequence <= len(data):
+            send_at = pace(sender, pacer)
+            if send_at is not None:
+                break
+            logger.debug("Creating window-packet #%s", next_sequence)
+            # Skips sequence #skip_seq (skip_seq) if test 1 is active
+            if skip and next_sequence == skip_seq:
+                skip = False  # To keep it from skipping multiple times
+            else:
+                send_segment(sender, data, next_sequence)
+                metrics.sent += 1
+            pacer.consume()
+            # A sequence sent before is a retransmission
+            if next_sequence in sent_at:
+                retransmitted.add(next_sequence)
+                metrics.retransmissions += 1
+            sent_at[next_sequence] = time.monotonic()
+            if next_sequence == sequence:
+                timer = sent_at[next_sequence]
+            highest_sent = max(highest_sent, next_sequence)
+            next_sequence += 1
+        sender.io.flush()  # Sends the burst
+
+        # Listens for acks from server that the packets have been received, until the retransmission timer
+        # expires or the pacer lets the next packet go. The timer only runs while packets are in flight
+        deadline = timer + sender.rto.timeout if next_sequence > sequence else None
+        wake = min(t for t in (deadline, send_at) if t is not None)
+        acks = sender.io.recv(wake - time.monotonic())
+        if not acks and deadline is not None and time.monotonic() >= deadline:
+            logger.debug("\nTimed out: ACK not received - resending from packet #%s", sequence)
+            check_idle(last_ack)
+            metrics.timeouts += 1
+            sender.rto.backoff()
+            cc.on_timeout()
+            # Goes back N: the window is refilled from the oldest unacknowledged sequence
+            next_sequence = sequence
+
+        for ack_msg, address in acks:
+            seq, ack, flags, win = parse_header(ack_msg)  # the header of the ack message
+            SYN, ACK, FIN = parse_flags(flags)
+            metrics.acks += 1
+
+            # The server acks cumulatively, so an ack also covers the sequences before it
+            if ACK and sequence <= ack <= highest_sent:
+                logger.debug("Correct ACK received #%s", ack)
+                dupacks = 0
+                # Sets rtt from the packet that triggered the ack, if it was not retransmitted
+                if sequence <= seq <= ack and seq not in retransmitted:
+                    sender.rto.sample(time.monotonic() - sent_at[seq])
+                cc.on_ack(ack - sequence + 1, ack, sender.rto.srtt)
+                pacer.update(cc, sender.rto.srtt)
+                while sequence <= ack:
+                    retransmitted.discard(sequence)
+                    del sent_at[sequence]
+                    sequence += 1
+                data.release(sequence)  # Pages behind the window are no longer needed
+                # Packets acked after going back N are not sent again
+                next_sequence = max(next_sequence, sequence)
+                # Restarts the timer for the next unacknowledged sequence
+                timer = last_ack = time.monotonic()
+
+            # An ack for the sequence before the oldest unacknowledged one means a packet after it was
+            # received out of order, so the oldest unacknowledged packet is most likely lost
+            elif ACK and ack == sequence - 1 and highest_sent >= sequence:
+                dupacks += 1
+                metrics.duplicate_acks += 1
+                if dupacks == dupack_threshold and ack >= recover:
+                    logger.debug("\n%s duplicate ACKs received - fast retransmit from packet #%s", dupacks, sequence)
+                    metrics.fast_retransmits += 1
+                    recover = highest_sent
+                    cc.on_loss(highest_sent)
+                    # Goes back N without waiting for the time-out
+                    next_sequence = sequence
+                elif dupacks > dupack_threshold:
+                    cc.on_dupack()
+
+    logger.info("\nAll data sent")
+    if cc.name != 'none':
+        logger.info("Congestion control %s: window %.1f, ssthresh %.1f packets", cc.name, cc.cwnd, cc.ssthresh)
+    # Returns data size for calculation of throughput value
+    return data.size
+
+
+# Selective repeat (client)
+def sr_c(sender, data, window):
+    # CLIENT - sender is the DRTPSender, and data the ChunkSource of the file to be sent
+    # window is the window size negotiated in the handshake
+    cc = congestion_controls[sender.cc](window)  # Limits the window to the congestion window
+    sequence = 1  # Oldest unacknowledged sequence
+    next_sequence = 1  # Next sequence to be sent
+    # Frame to keep track of acked sequences within the window, sequence #i is kept in frame[i % window]
+    frame = [False] * window
+    sent_at = {}  # Last send time of each sequence in the window
+    retransmitted = set()  # Karn's rule: no RTT samples from retransmitted packets
+    # Every packet has its own retransmission timer: a heap of (deadline, sequence), where an entry
+    # is only valid while it matches deadlines[sequence], so acked packets are dropped lazily
+    timers = []
+    deadlines = {}
+    last_backoff = 0  # Packets sent before the last backoff belong to the same loss event
+    last_ack = time.monotonic()  # When a packet was last acked
+    pacer = Pacer(sender.rate, sender.pace, 12 + data.chunk_size)  # Spreads the window over the RTT
+    pacer.update(cc, sender.rto.srtt)
+    metrics = sender.metrics
+
+    # Initialising for test case skip_seq
+    if sender.test == 'skip_seq':
+        skip = True  # A skip to be done
+        skip_seq = 4  # Skips packet #4
+    else:
+        skip = False
+        skip_seq = 0
+
+    # Send the content of the requested file to the server
+    while sequence <= len(data):
+        metrics.tick(sequence - 1, next_sequence - sequence, cc.cwnd, sender.rto)
+        # Fills the window, as fast as the pacer lets it
+        send_at = None  # When the pacer lets the next packet go, if it held it back
+        while next_sequence < sequence + cc.window() and next_sequence <= len(data):
+            send_at = pace(sender, pacer)
+            if send_at is not None:
+                break
+            logger.debug("Creating window-packet #%s", next_sequence)
+            # Skips sequence #skip_seq (skip_seq) if test 1 is active
+            if skip and next_sequence == skip_seq:
+                skip = False  # To keep it from skipping multiple times
+            else:
+                send_segment(sender, data, next_sequence)
+                metrics.sent += 1
+            pacer.consume()
+            now = time.monotonic()
+            sent_at[next_sequence] = now
+            deadlines[next_sequence] = now + sender.rto.timeout
+            heapq.heappush(timers, (deadlines[next_sequence], next_sequence))
+            next_sequence += 1
+
+        # Resends only the packets whose own timer has expired
+        now = time.monotonic()
+        while timers and timers[0][0] <= now:
+            deadline, i = heapq.heappop(timers)
+            if deadlines.get(i) != deadline:
+                continue  # Acked or rescheduled since
+            logger.debug("Timed out: ACK not received for packet #%s", i)
+            check_idle(last_ack)
+            metrics.timeouts += 1
+            # Backs off once per loss event, and again for packets that were sent after the backoff
+            if sent_at[i] >= last_backoff:
+                sender.rto.backoff()
+                cc.on_timeout()
+                last_backoff = now
+            send_segment(sender, data, i)
+            metrics.sent += 1
+            metrics.retransmissions += 1
+            pacer.consume()  # Retransmissions are not held back, but use up tokens
+            retransmitted.add(i)
+            sent_at[i] = now
+            deadlines[i] = now + sender.rto.timeout
+            heapq.heappush(timers, (deadlines[i], i))
+        sender.io.flush()  # Sends the burst and the retransmissions
+
+        # Drops the timers of acked packets from the top of the heap
+        while timers and deadlines.get(timers[0][1]) != timers[0][0]:
+            heapq.heappop(timers)
+
+        # Listens for acks from server until the earliest timer expires or the pacer lets the next packet go
+        wake = min(t for t in (timers[0][0] if timers else None, send_at) if t is not None)
+        for ack_msg, address in sender.io.recv(wake - now):
+            seq, ack, flags, win = parse_header(ack_msg)  # the header of the ack message
+            SYN, ACK, FIN = parse_flags(flags)
+            metrics.acks += 1
+
+            if ACK:
+                # The ack is cumulative, and the selective ack blocks add the ranges held beyond it
+                acked = 0
+                for first, last in [(sequence, ack)] + parse_sack(ack_msg[12:]):
+                    for i in range(max(first, sequence), min(last, next_sequence - 1) + 1):
+                        # Stores ack if it is within the window and stops the timer of the packet
+                        if not frame[i % window]:
+                            frame[i % window] = True
+                            del deadlines[i]
+                            acked += 1
+                            # Sets rtt from the packet that triggered the ack, if it was not retransmitted
+                            if i == seq and i not in retransmitted:
+                                sender.rto.sample(time.monotonic() - sent_at[i])
+                if acked:
+                    logger.debug("Correct ACK received #%s - %s packets acked", ack, acked)
+                    last_ack = time.monotonic()
+                    cc.on_ack(acked, ack, sender.rto.srtt)
+                    pacer.update(cc, sender.rto.srtt)
+                else:
+                    metrics.duplicate_acks += 1
+
+            # Moves the window
+            while frame[sequence % window]:
+                logger.debug("window moves")
+                frame[sequence % window] = False
+                retransmitted.discard(sequence)
+                del sent_at[sequence]
+                sequence += 1
+                data.release(sequence)  # Pages behind the window are no longer needed
+
+    logger.info("\nAll data sent")
+    if cc.name != 'none':
+        logger.info("Congestion control %s: window %.1f, ssthresh %.1f packets", cc.name, cc.cwnd, cc.ssthresh)
+    # Returns data size for calculation of throughput value
+    return data.size
+
+
+# Server #
+# A class that keeps the state of one connection on the server
+# The server creates one for every client address that sends a SYN, so many clients can send at once
+class ReceiverSession:
+    def __init__(self, receiver, address, output, transfer=None, start=None):
+        self.receiver = receiver  # DRTPReceiver the connection was made to
+        self.address = address  # Address of the client
+        self.output = output  # File the data is written to
+        self.transfer = transfer or self  # The parallel transfer of the stream, or the session itself
+        self.start = start  # Offset of the byte range of a stream in the output file
+        self.window = receiver.window  # Window advertised in the SYN ACK
+        self.mss = chunk_size  # Segment size chosen in the SYN ACK
+        self.data_size = 0  # Bytes written to the output file
+        self.writer = None  # ChunkWriter (or FrameWriter), opened when the connection is established
+        self.sequence = 0  # Receive progress
+        self.duplicates = 0  # Data packets received again
+        self.out_of_order = 0  # Data packets received ahead of a gap
+        self.file_id = 0  # Id of the data of a resumable transfer
+        self.resumed = 0  # Bytes of the data that were received by an earlier connection
+        self.checkpoint = None  # File the progress of a resumable transfer is kept in
+        self.saved = 0  # When the last checkpoint was written
+        self.manifest = None  # (block size, size, hashes) of a deduplicated transfer
+        self.bitmap = None  # Blocks of a deduplicated transfer that the client sends, answered in the SYN ACK
+        self.needed = []  # Blocks of a deduplicated transfer that the client sends, in order
+        self.cached = 0  # Bytes of a deduplicated transfer that were taken from the block cache
+        self.compressed = False  # Whether the data is sent in compressed frames (see FrameWriter)
+        self.digest = None  # SegmentDigest of the delivered segments of a checked transfer
+        self.corrupt = 0  # Data packets of a checked transfer whose CRC32 did not match
+        self.verified = None  # Whether the digest in the FIN of a checked transfer matched
+        self.verify_time = 0  # Seconds spent on the CRC32s and the digest
+        self.finished = False  # Set when the FIN is received
+        # Why a finished transfer failed (the digest in the FIN did not match, or a frame could not be
+        # decompressed), or None
+        self.error = None
+        self.last_packet = time.monotonic()  # Used to time out idle connections
+        self.cpu_start = time.process_time()  # CPU time spent since the connection was made
+
+        # Stop-and-wait has a single packet in flight, so its acks are never delayed
+        if receiver.reliability == "stop-and-wait":
+            self.delayed = DelayedAck()
+        else:
+            self.delayed = DelayedAck(receiver.ack_every, receiver.ack_delay)
+
+        # Test case skip_ack to skip the sending of a specific ack
+        self.skip = receiver.test == 'skip_ack'  # A skip to be done
+        self.skip_ack = 5  # Skips ack #5
+
+    def handle(self, msg):
+        # Takes a packet from the client and returns the reply to send, or None
+        self.last_packet = time.monotonic()
+
+        # Parsing the header
+        seq, ack, flags, win = parse_header(msg)
+        logger.debug("\nseq=%s, ack=%s, flags=%s, receiver-window=%s", seq, ack, flags, win)
+        SYN, ACK, FIN = parse_flags(flags)
+
+        if SYN:
+            logger.info("SYN received from %s: flags set: syn-> %s, ack-> %s, fin-> %s", self.address, SYN, ACK, FIN)
+            # The client proposes a segment size in the SYN, and the smallest of it and our own is sent back
+            # in the SYN ACK
+            mss, stream, file_id, manifest = parse_syn(msg)
+            self.mss = min(mss, self.receiver.mss)
+            # A compressed transfer is accepted by echoing its flag. The first SYN decides, since the data
+            # may already be on its way when a resent SYN arrives
+            if self.writer is None:
+                self.compressed = bool(flags & compress_flag)
+                self.digest = SegmentDigest() if flags & checksum_flag else None
+            logger.info("Segment size negotiated: %s bytes", self.mss)
+            body = mss_struct.pack(self.mss)
+            # A deduplicated transfer is told which blocks to send (see deduplicate), and a resumable one how
+            # many bytes are held already (see resume)
+            if manifest is not None and self.receiver.cache is not None and self.transfer is self:
+                if self.bitmap is None:
+                    self.bitmap = self.deduplicate(manifest)
+                body += resume_struct.pack(0) + self.bitmap
+            elif file_id:
+                if self.writer is None:
+                    self.resume(file_id)
+                body += resume_struct.pack(self.resumed)
+            # S A F R - SYN ACK FIN RST
+            # Sends SYN ACK (1 1 0 0) and advertises the receiver buffer in packets
+            logger.info("SYN ACK sent")
+            flags = 12 | (compress_flag if self.compressed else 0) | (checksum_flag if self.digest else 0)
+            return create_packet(0, 0, flags, self.window, body)
+
+        if seq > 0:
+            # The payload is a view of the received datagram, so it is not copied on its way to the writer
+            payload = memoryview(msg)[12:]
+            # A segment of a checked transfer whose CRC32 does not match is dropped, as if it had been lost
+            if self.digest is not None:
+                started = time.perf_counter()
+                valid = len(payload) >= crc_struct.size and (crc_struct.unpack_from(payload)[0]
+                                                             == segment_crc(seq, payload[crc_struct.size:]))
+                self.verify_time += time.perf_counter() - started
+                if not valid:
+                    self.corrupt += 1
+                    logger.debug("Corrupt packet #%s dropped", seq)
+                    return None
+                payload = payload[crc_struct.size:]
+            # Data also establishes the connection, in case the ACK of the handshake was lost
+            if self.writer is None:
+                self.establish()
+            reply, in_order = self.receive(seq, payload)
+            # Out-of-order packets are acked at once, so the client learns about the loss without delay
+            reply = self.delayed.ack(reply, self.address, not in_order)
+
+            if reply is None:
+                return None  # The ack is held back
+            # Skips ack #5 (skip_ack) if the respective test is active triggering a retransmission
+            if self.skip and self.sequence >= self.skip_ack:
+                self.skip = False  # To keep it from skipping multiple times
+                logger.debug("Skipping ACK #%s", self.sequence)
+                return None
+            # Keeps the progress of a resumable transfer every checkpoint_interval seconds
+            if self.checkpoint is not None and self.last_packet - self.saved >= checkpoint_interval:
+                self.save()
+            # Sends ack
+            logger.debug("Sending acknowledgment packet #%s", self.sequence)
+            return reply
+
+        if FIN:
+            if not self.finished:
+                if self.digest is not None:
+                    self.verify(bytes(msg[12:12 + digest_size]))
+                self.finish()
+            # Sends ACK (0 1 0 0), also for a FIN that is resent, with reject_flag if the transfer failed
+            logger.info("ACK sent")
+            return create_packet(0, 0, 4 | (reject_flag if self.error else 0), 0, b'')
+
+        if ACK and self.writer is None:
+            self.establish()
+        return None
+
+    def receive(self, seq, payload):
+        # Takes a data packet, and returns the ack and whether the packet arrived in order
+        raise NotImplementedError
+
+    def deliver(self, payload):
+        # Hands an in-order segment to the writer, and hashes it first for a checked transfer
+        if self.digest is not None:
+            started = time.perf_counter()
+            self.digest.update(payload)
+            self.verify_time += time.perf_counter() - started
+        self.writer.write(payload)
+
+    def verify(self, digest):
+        # Compares the digest of the segments in the FIN with the digest of the segments delivered
+        started = time.perf_counter()
+        self.verified = digest == self.digest.digest()
+        self.verify_time += time.perf_counter() - started
+        if self.verified:
+            logger.info("The digest of the %s segments from %s matches", self.digest.count, self.address)
+        else:
+            self.error = "the digest of the data does not match"
+            logger.error("The digest of the data from %s does not match, %s may be corrupt", self.address,
+                         self.output)
+
+    def resume(self, file_id):
+        # Looks up the checkpoint of a resumable transfer, and resumes it after the bytes that an earlier
+        # connection wrote. The segments reach the writer in order (SR reorders them in its frame first), so
+        # what a connection has written is always a prefix of its byte range, and the checkpoint only keeps
+        # its length. Every connection that is resumed starts its segments over from 1 after it
+        if not self.receiver.resume:
+            return
+        self.file_id = file_id
+        self.checkpoint = checkpoint_name(self.output, self.start)
+        checkpoint = load_checkpoint(self.checkpoint)
+        start = self.start or 0
+        self.resumed = 0
+        if (checkpoint is not None and checkpoint.get('file_id') == file_id and checkpoint.get('start') == start
+                and os.path.exists(self.output) and os.path.getsize(self.output) >= start + checkpoint['held']):
+            self.resumed = checkpoint['held']
+            logger.info("Resuming the transfer from %s after %s bytes", self.address, self.resumed)
+
+    def save(self):
+        # Writes the checkpoint with the bytes of the range that are in the output file
+        self.saved = time.monotonic()
+        held = self.resumed + (self.writer.offset - self.writer.start if self.writer is not None else 0)
+        save_checkpoint(self.checkpoint, dict(file_id=self.file_id, start=self.start or 0, held=held))
+
+    def deduplicate(self, manifest):
+        # Writes the blocks of the file that are in the block cache to the output file, and returns the
+        # bitmap of the blocks the client has to send. The blocks that are sent are written straight to
+        # their place in the file (see ChunkWriter ranges), and stored in the cache when the transfer is
+        # finished. The cached blocks are copied at once, so the cache may evict them while the transfer runs
+        block, size, hashes = self.manifest = manifest
+        bitmap = bytearray(-(-len(hashes) // 8))
+        fd = os.open(self.output, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        try:
+            os.ftruncate(fd, size)
+            for i, digest in enumerate(hashes):
+                data = self.receiver.cache.get(digest)
+                if data is not None and len(data) == min(block, size - i * block):
+                    os.pwrite(fd, data, i * block)
+                    self.cached += len(data)
+                else:
+                    self.needed.append(i)
+                    bitmap[i >> 3] |= 0x80 >> (i & 7)
+        finally:
+            os.close(fd)
+        logger.info("%s of %s blocks are in the cache, %s blocks to be sent", len(hashes) - len(self.needed),
+                    len(hashes), len(self.needed))
+        return bytes(bitmap)
+
+    def establish(self):
+        logger.info("Ready to receive a file from %s!", self.address)
+        # Writes or overwrites the data to a new file as it is delivered. A resumed transfer writes after
+        # the bytes it already holds, and keeps them, and a deduplicated one writes the blocks it is sent
+        # in their place. The frames of a compressed transfer are decompressed on their way to the writer
+        start = self.start
+        if self.resumed:
+            start = (start or 0) + self.resumed
+        ranges = None
+        if self.manifest is not None:
+            block, size, hashes = self.manifest
+            ranges = [(i * block, min(block, size - i * block)) for i in self.needed]
+        release = self.receiver.io.release
+        self.writer = ChunkWriter(self.output, self.receiver.batch, self.receiver.preallocate,
+                                  None if self.compressed else release, start, ranges)
+        if self.compressed:
+            self.writer = FrameWriter(self.writer, release)
+
+    def finish(self):
+        if self.writer is None:
+            self.establish()
+        self.finished = True
+        logger.info("Transfer finished")
+        cpu_time = (time.process_time() - self.cpu_start) * 1000
+        logger.info("%s packets received (%s duplicates, %s out of order), %s ACKs sent, CPU time: %.2fms",
+                    self.delayed.packets, self.duplicates, self.out_of_order, self.delayed.acks, cpu_time)
+        self.data_size = self.writer.close()  # Flushes the last batch
+        if self.compressed and self.writer.error is not None:
+            self.error = f"a frame could not be decompressed ({self.writer.error})"
+        if self.manifest is not None and self.error is None:
+            self.receiver.cache.store(self.output, self.manifest, self.needed)
+        logger.info("%s bytes written to %s", self.data_size, self.output)
+        if self.manifest is not None:
+            logger.info("%s bytes were taken from the block cache", self.cached)
+        if self.error is not None:
+            logger.error("The transfer from %s failed: %s", self.address, self.error)
+        if self.digest is not None:
+            logger.info("%s corrupt packets dropped, checksums and digest: %.2fms", self.corrupt,
+                        self.verify_time * 1000)
+        if self.checkpoint is not None:
+            if self.resumed:
+                logger.info("%s bytes were kept from the earlier transfer", self.resumed)
+                # The file of an ordinary transfer is cut to the size of the data, in case space was
+                # preallocated beyond it before the transfer was interrupted
+                if self.transfer is self:
+                    os.truncate(self.output, self.resumed + self.data_size)
+            try:
+                os.remove(self.checkpoint)
+            except FileNotFoundError:
+                pass
+        if self.transfer is not self:
+            self.transfer.add(self.resumed + self.data_size, self.error)
+        self.report()
+
+    def abort(self):
+        # Keeps what was received so far when the client goes away
+        logger.warning("Timed out: Did not receive packet or ACK from %s", self.address)
+        if self.digest is not None:
+            self.digest.close()
+        if self.writer is not None:
+            self.data_size = self.writer.close()
+            # A resumable transfer can be resumed from here
+            if self.checkpoint is not None:
+                self.save()
+        self.report()
+
+    def retire(self):
+        # Gives the output up to a new connection of the same resumable transfer (see SessionTable.get).
+        # The new session owns the file and the checkpoint now, so the writer is closed without cutting
+        # the file, and no checkpoint is written
+        logger.info("The transfer from %s is resumed by a new connection", self.address)
+        if self.digest is not None:
+            self.digest.close()
+        if self.writer is not None:
+            self.data_size = self.writer.close(truncate=False)
+        self.checkpoint = None
+
+    def report(self):
+        # Hands the stats of the finished or aborted session to the report callback of the receiver
+        # (the supervisor of the workers, see serve_workers)
+        if self.receiver.report is None:
+            return
+        transfer = None
+        if self.transfer is not self:
+            transfer = (self.address[0], self.transfer.transfer_id, self.transfer.size)
+        self.receiver.report(dict(address=self.address, output=self.output, data_size=self.data_size,
+                                  packets=self.delayed.packets, acks=self.delayed.acks,
+                                  duplicates=self.duplicates, out_of_order=self.out_of_order, mss=self.mss,
+                                  resumed=self.resumed, cached=self.cached, compressed=self.compressed,
+                                  corrupt=self.corrupt, verified=self.verified,
+                                  verify_ms=round(self.verify_time * 1000, 3),
+                                  cpu_time=(time.process_time() - self.cpu_start) * 1000,
+                                  finished=self.finished, error=self.error, transfer=transfer))
+
+
+# Server session for both stop-and-wait and GBN
+class ReactiveSession(ReceiverSession):
+    def receive(self, seq, payload):
+        in_order = seq == self.sequence + 1
+        if in_order:
+            logger.debug("Correct packet received #%s", seq)
+            self.receiver.io.hold(payload)  # Kept until the writer has written it
+            self.deliver(payload)  # Hands the data over to the writer
+            self.sequence += 1  # Increments progress
+        elif seq <= self.sequence:
+            self.duplicates += 1
+        else:
+            self.out_of_order += 1
+
+        # The ack is cumulative and echoes the sequence that triggered it, flags, window and body are fixed
+        return create_ack(seq, self.sequence), in_order
+
+
+# Selective repeat (server session)
+class SRSession(ReceiverSession):
+    def __init__(self, receiver, address, output, transfer=None, start=None):
+        super().__init__(receiver, address, output, transfer, start)
+        # Buffers the out-of-order data within the window, sequence #i is kept in frame[i % window]
+        self.frame = [None] * self.window
+        self.held = 0  # Number of out-of-order packets in the frame
+        # Runs of consecutive out-of-order packets held in the frame, kept sorted and flat as
+        # [first, last, first, last, ...] and updated on every packet, so the SACK blocks are not searched for
+        self.runs = []
+
+    def receive(self, seq, payload):
+        window = self.window
+        frame = self.frame
+        # Only a packet that arrives in order with no gaps behind it may have its ack delayed
+        in_order = seq == self.sequence + 1 and self.held == 0
+
+        if self.sequence + 1 <= seq < self.sequence + window + 1:
+            logger.debug("Correct packet received #%s", seq)
+            # A packet that is already buffered is a duplicate
+            if frame[seq % window] is None:
+                self.held += 1
+                self.receiver.io.hold(payload)  # Kept until the writer has written it
+                frame[seq % window] = payload  # Buffers decoded data
+                if seq != self.sequence + 1:
+                    self.out_of_order += 1
+                    self.add_run(seq)
+            else:
+                self.duplicates += 1
+            # Moves the window and stores buffered data
+            while frame[(self.sequence + 1) % window] is not None:
+                self.sequence += 1
+                self.held -= 1
+                self.deliver(frame[self.sequence % window])  # Moves from buffer frame into the writer
+                frame[self.sequence % window] = None
+            # The first run has been written if the packet filled the gap in front of it
+            if self.runs and self.runs[1] <= self.sequence:
+                del self.runs[:2]
+        elif seq <= self.sequence:
+            self.duplicates += 1  # Written already, its ack was lost
+
+        # Selective ack blocks for the lowest runs held in the frame, flat as create_ack takes them.
+        # The ack is cumulative and echoes the sequence that triggered it, flags and window are fixed
+        return create_ack(seq, self.sequence, self.runs[:2 * max_sack_blocks]), in_order
+
+    def add_run(self, seq):
+        # Adds an out-of-order packet, which is in no run yet, to the runs: it extends the run just before
+        # or just after it, joins the two, or starts a run of its own
+        runs = self.runs
+        i = bisect.bisect_left(runs, seq)  # Index of the first of the run after it
+        after = i > 0 and runs[i - 1] == seq - 1
+        before = i < len(runs) and runs[i] == seq + 1
+        if after and before:
+            del runs[i - 1:i + 1]
+        elif after:
+            runs[i - 1] = seq
+        elif before:
+            runs[i] = seq
+        else:
+            runs[i:i] = (seq, seq)
+
+    def abort(self):
+        super().abort()
+        self.release_frame()
+
+    def retire(self):
+        super().retire()
+        self.release_frame()
+
+    def release_frame(self):
+        # Gives the buffers of the out-of-order data back
+        for payload in self.frame:
+            if payload is not None:
+                self.receiver.io.release(payload)
+        self.frame = [None] * self.window
+        self.runs = []
+
+
+# A function that names the output file of a connection
+def output_name(template, address, count, keep_running, transfer_id=0):
+    # The name may use {host}, {port}, {n} (number of the connection) and {id} (transfer id of a parallel
+    # transfer, or file id of a resumable one). When the server keeps running and the name has none of them,
+    # "-{host}-{port}-{n}" is added before the extension. A parallel or resumable transfer gets "-{host}-{id}"
+    # instead, since its streams come from many ports and may be served by different workers (or it comes
+    # back from another port), which must all find the same file
+    if keep_running and '{' not in template:
+        stem, extension = os.path.splitext(template)
+        template = stem + ('-{host}-{id}' if transfer_id else '-{host}-{port}-{n}') + extension
+    return template.format(host=address[0], port=address[1], n=count, id=f'{transfer_id:08x}')
+
+
+# A class that keeps the state of a parallel transfer, whose streams are received by sessions of their own
+# Each stream writes its byte range into the one output file, and the transfer is finished once all the
+# bytes of the file have been written
+class StreamTransfer:
+    def __init__(self, address, output, transfer_id, size, preallocate=False):
+        self.address = address  # Address of the client that opened the first stream
+        self.output = output  # File the streams are written to
+        self.transfer_id = transfer_id
+        self.size = size  # Size of the whole file
+        self.data_size = 0  # Bytes written by the finished streams
+        self.streams = 0  # Number of finished streams
+        self.finished = size == 0
+        self.error = None  # Why a stream of the transfer failed, or None
+
+        # The file is created at its full size, so the streams can write their ranges in any order. It is
+        # not truncated, since a worker serving other streams of the transfer may have written to it already
+        fd = os.open(output, os.O_WRONLY | os.O_CREAT, 0o644)
+        try:
+            if preallocate and hasattr(os, 'posix_fallocate') and size:
+                os.posix_fallocate(fd, 0, size)
+            else:
+                os.ftruncate(fd, size)
+        finally:
+            os.close(fd)
+
+    def add(self, written, error=None):
+        # Takes the byte count of a finished stream, and why it failed if it did
+        self.data_size += written
+        self.streams += 1
+        if error is not None:
+            self.error = error
+        if self.data_size >= self.size and not self.finished:
+            self.finished = True
+            logger.info("Parallel transfer finished: %s bytes written to %s by %s streams",
+                        self.data_size, self.output, self.streams)
+
+
+# A class that demultiplexes the packets by the address of the client into one ReceiverSession each
+class SessionTable:
+    def __init__(self, receiver, output, keep_running):
+        self.receiver = receiver  # DRTPReceiver the sessions belong to
+        self.output = output  # Name (or template) of the output files
+        self.keep_running = keep_running  # Whether many transfers are served
+        self.sessions = {}  # Sessions by client address
+        self.transfers = {}  # Parallel transfers by (client host, transfer id)
+        self.count = 0  # Number of connections so far (a parallel transfer counts once)
+        self.session_class = SRSession if receiver.reliability == "SR" else ReactiveSession
+
+    def get(self, msg, address):
+        # Returns the session of the client, or None if the packet does not belong to any
+        session = self.sessions.get(address)
+        SYN = parse_flags(parse_header(msg)[2])[0]
+
+        # A SYN from a new client (or from a client whose last transfer finished) opens a new session
+        if SYN and (session is None or session.finished):
+            active = sum(not s.finished for s in self.sessions.values())
+            if active >= self.receiver.max_sessions:
+                logger.warning("Session limit reached: ignoring SYN from %s", address)
+                return None
+            # The SYN of a stream of a parallel transfer names the transfer, and the stream writes its byte
+            # range into the output file of the transfer
+            mss, (transfer_id, start, size), file_id, manifest = parse_syn(msg)
+            if transfer_id:
+                # The byte range has to lie in a file of a size the server is willing to create
+                transfer = self.transfers.get((address[0], transfer_id))
+                if not start < size <= max_file_size or (transfer is not None and size != transfer.size):
+                    logger.warning("Ignoring SYN from %s: stream at %s of a file of %s bytes", address, start, size)
+                    return None
+                if transfer is None:
+                    output = output_name(self.output, address, self.count + 1, self.keep_running, transfer_id)
+                    try:
+                        transfer = StreamTransfer(address, output, transfer_id, size, self.receiver.preallocate)
+                    except OSError as e:
+                        logger.warning("Ignoring SYN from %s: %s can not be created: %s", address, output, e)
+                        return None
+                    self.count += 1
+                    self.transfers[(address[0], transfer_id)] = transfer
+                session = self.session_class(self.receiver, address, transfer.output, transfer, start)
+            else:
+                # A resumable transfer is named by its file id, so a client that comes back from another port
+                # finds the file it was writing to
+                self.count += 1
+                output = output_name(self.output, address, self.count, self.keep_running,
+                                     file_id if self.receiver.resume else 0)
+                session = self.session_class(self.receiver, address, output)
+            # A client that comes back to resume a transfer (from another port) takes over from the
+            # session that was writing it, which would otherwise time out later and cut the file or write
+            # a stale checkpoint
+            if file_id and self.receiver.resume:
+                for other_address, other in list(self.sessions.items()):
+                    if not other.finished and other.output == session.output and other.start == session.start:
+                        other.retire()
+                        del self.sessions[other_address]
+            self.sessions[address] = session
+        return session
+
+    def dispatch(self, msg, address):
+        # Hands a packet to the session of its client, and returns the session and the reply to send (None
+        # for none). A datagram too short for a header is dropped, and so is a packet its session fails on,
+        # with a warning, so one bad peer can not take the server down with the sessions of the others
+        if len(msg) < header_struct.size:
+            return None, None
+        try:
+            session = self.get(msg, address)
+            return session, session.handle(msg) if session is not None else None
+        except Exception as e:
+            logger.warning("Dropped a packet from %s: %s", address, e)
+            return None, None
+
+    def expire(self, now):
+        # Drops the sessions that have been idle for too long, and returns the ones that were aborted
+        # Finished sessions stay for a while, to ack a FIN that is resent
+        aborted = []
+        for address, session in list(self.sessions.items()):
+            if now - session.last_packet >= idle_timeout:
+                del self.sessions[address]
+                if not session.finished:
+                    session.abort()
+                    aborted.append(session)
+        # A parallel transfer is dropped with the last of its sessions
+        active = {session.transfer for session in self.sessions.values()}
+        for key, transfer in list(self.transfers.items()):
+            if transfer not in active:
+                del self.transfers[key]
+        return aborted
+
+
+# A function that serves the clients on the socket of the receiver
+# Without keep_running it returns the first transfer (a session, or the StreamTransfer of a parallel
+# transfer), once it is finished or timed out. A finished transfer is only returned once its client has
+# sent nothing for time_wait, so a FIN that is resent because its ACK was lost is still acked
+def serve(receiver, output, keep_running):
+    table = SessionTable(receiver, output, keep_running)
+    done = None  # Session that finished the first transfer, without keep_running
+
+    while True:
+        # Waits for the next packet, but no longer than until a delayed ack or an idle time-out is due
+        now = time.monotonic()
+        deadlines = []
+        for session in table.sessions.values():
+            if session.delayed.msg is not None:
+                deadlines.append(session.delayed.deadline)
+            deadlines.append(session.last_packet + idle_timeout)
+        if done is not None:
+            deadlines.append(done.last_packet + time_wait)
+
+        for msg, sender_address in receiver.io.recv(min(deadlines) - now if deadlines else None):
+            session, reply = table.dispatch(msg, sender_address)
+            if reply is not None:
+                receiver.io.send(reply, sender_address)
+            receiver.io.recycle(msg)
+            # Without keep_running, the server shuts down after the first transfer
+            if done is None and session is not None and session.transfer.finished and not keep_running:
+                done = session
+
+        # Sends the delayed acks that are due, and drops the sessions that have been idle for too long
+        now = time.monotonic()
+        for session in table.sessions.values():
+            if session.delayed.msg is not None and session.delayed.deadline <= now:
+                reply, reply_address = session.delayed.expire()
+                logger.debug("Sending delayed acknowledgment packet")
+                receiver.io.send(reply, reply_address)
+        receiver.io.flush()  # Sends the acks of the batch
+        if done is not None and now - done.last_packet >= time_wait:
+            return done.transfer
+        aborted = table.expire(now)
+        if aborted and not keep_running and done is None:
+            return aborted[0].transfer
+
+
+# asyncio transport #
+# A class that sends one file over DRTP from an asyncio event loop
+# The handshake, the data and the FIN are driven by datagram_received, and every timer is a
+# loop.call_later handle instead of a socket timeout, so one loop can drive many transfers
+class DRTPClientProtocol(asyncio.DatagramProtocol):
+    def __init__(self, sender, source, stream=None):
+        self.sender = sender  # DRTPSender with the settings of the transfer
+        self.source = source  # File name or bytes-like object to be sent
+        self.stream = stream  # (transfer id, start, length, size) of a stream of a parallel transfer, or None
+        self.data = None  # ChunkSource of the data, opened when the segment size is known
+        # Blocks of a deduplicated transfer, and id of the data of a resumable transfer
+        self.manifest = create_manifest(source) if sender.dedup and stream is None else None
+        self.file_id = source_id(source) if sender.resume and self.manifest is None else 0
+        self.mss = sender.mss  # Segment size proposed in the SYN, lowered by the probe and the SYN ACK
+        self.reliability = sender.reliability
+        self.window = sender.window  # Lowered to the window advertised by the server in the SYN ACK
+        self.loop = asyncio.get_running_loop()
+        self.done = self.loop.create_future()  # Set to the elapsed time of the transfer in ms
+        self.transport = None
+        self.rto = sender.rto
+        self.cc = None  # Congestion control, created when the window is known
+        self.state = 'SYN'  # SYN -> DATA -> FIN
+        self.attempts = 0  # Times the SYN or the FIN has been resent
+        self.control_sent_at = 0  # Send time of the SYN, for the first RTT sample
+        self.start_time = 0
+
+        self.sequence = 1  # Oldest unacknowledged sequence
+        self.next_sequence = 1  # Next sequence to be sent
+        self.highest_sent = 0  # Highest sequence sent so far
+        self.sent_at = {}  # Last send time of each sequence in the window
+        self.retransmitted = set()  # Karn's rule: no RTT samples from retransmitted packets
+        self.acked = set()  # SR: sequences acked beyond the oldest unacknowledged one
+        self.timer = None  # Timer of the SYN, the FIN or the oldest unacknowledged packet (GBN)
+        self.timers = {}  # SR: timer of every packet in flight
+        self.last_backoff = 0  # SR: packets sent before the last backoff belong to the same loss event
+        self.dupacks = 0  # GBN: duplicate acks for the oldest unacknowledged sequence
+        self.recover = 0  # GBN: highest sequence sent at the last fast retransmit
+        self.pacer = None  # Spreads the window over the RTT, created when the segment size is known
+        self.pace_timer = None  # Fills the window again when the pacer lets the next packet go
+        self.last_ack = 0  # When a packet was last acked
+        self.metrics = None  # TransferMetrics of the transfer, created when the segment size is known
+        self.digest = None  # SegmentDigest of the segments sent by a checked transfer
+
+        # Test case skip_seq
+        self.skip_seq = 5 if sender.test == 'skip_seq' else 0
+
+    def connection_made(self, transport):
+        self.transport = transport
+        # As in DRTPSender, a segment size above the default is probed with the SYN, so the datagrams of the
+        # transport must not be fragmented for a SYN that is too large to fail with EMSGSIZE (error_received)
+        if self.mss > chunk_size:
+            set_dont_fragment(transport.get_extra_info('socket'))
+        self.send_control(8)  # 1 0 0 0  SYN flag
+
+    def error_received(self, exc):
+        # A SYN that is too large for the path is resent with a smaller segment size at once
+        if self.state == 'SYN' and getattr(exc, 'errno', None) == errno.EMSGSIZE and self.mss > chunk_size:
+            self.timer.cancel()
+            self.mss = smaller_mss(self.mss)
+            logger.info("SYN too large for the path: proposing a segment size of %s bytes", self.mss)
+            self.send_control(8)
+            return
+        if not self.done.done():
+            self.done.set_exception(exc)
+
+    def send_control(self, flags):
+        # Sends the SYN or the FIN, and resends it with backoff on time-outs. The timer is started first,
+        # since a failed send calls error_received() before sendto() returns
+        self.control_sent_at = time.monotonic()
+        self.timer = self.loop.call_later(self.rto.timeout, self.control_timeout, flags)
+        if flags == 8:
+            self.transport.sendto(create_syn(self.mss, syn_stream(self.stream), self.file_id, self.manifest,
+                                             self.sender.compression is not None, self.sender.checksum))
+        else:
+            # The FIN of a checked transfer carries the digest of the segments
+            body = self.digest.digest() if flags == 2 and self.digest is not None else b''
+            self.transport.sendto(create_packet(0, 0, flags, 0, body))
+
+    def control_timeout(self, flags):
+        self.attempts += 1
+        if self.attempts > max_retries:
+            self.done.set_exception(TimeoutError('the server did not answer'))
+            return
+        self.rto.backoff()
+        # A lost SYN may have been too large for the path, so the next one proposes a smaller segment size
+        if flags == 8:
+            self.mss = smaller_mss(self.mss)
+        self.send_control(flags)
+
+    def datagram_received(self, msg, address):
+        seq, ack, flags, win = parse_header(msg[:12])
+        SYN, ACK, FIN = parse_flags(flags)
+
+        if self.state == 'SYN' and SYN and ACK:
+            self.timer.cancel()
+            # The handshake gives the first RTT sample, unless the SYN was resent
+            if self.attempts == 0:
+                self.rto.sample(time.monotonic() - self.control_sent_at)
+            if win:
+                self.window = min(self.window, win)
+            # The segment size chosen by the server, or the default if it did not send one, the bytes it
+            # holds already of a resumable transfer and the blocks it needs of a deduplicated one
+            mss, held, bitmap = parse_syn_ack(msg)
+            held = held if self.file_id else 0
+            ranges = needed_ranges(self.manifest, bitmap) if self.manifest is not None and bitmap is not None else None
+            self.mss = min(self.mss, mss)
+            start, length = self.stream[1:3] if self.stream else (0, None)
+            compression = self.sender.compression if flags & compress_flag else None
+            # The segments of a checked transfer leave room for the CRC32, so the packets are no larger
+            checked = self.sender.checksum and flags & checksum_flag
+            size = max(self.mss - crc_struct.size, 1) if checked else self.mss
+            self.digest = SegmentDigest() if checked else None
+            self.data = open_source(self.source, size, start + held, None if length is None else length - held,
+                                    ranges, compression, self.sender.level)
+            self.pacer = Pacer(self.sender.rate, self.sender.pace, 12 + self.mss)
+            if self.reliability == 'stop-and-wait':
+                self.cc = CongestionControl(1)
+            else:
+                self.cc = congestion_controls[self.sender.cc](self.window)
+            self.pacer.update(self.cc, self.rto.srtt)
+            # The RTO estimator may be shared by many transfers on the loop, so the samples are handed to the
+            # metrics by sample() instead of by the estimator
+            self.metrics = self.sender.metrics = TransferMetrics(
+                None, self.sender.report, self.sender.report_interval, reliability=self.reliability,
+                cc=self.sender.cc, window=self.window, mss=self.mss, compression=compression)
+            self.transport.sendto(create_packet(0, 0, 4, 0, b''))  # 0 1 0 0  ACK flag
+            self.state = 'DATA'
+            self.timer = None
+            self.start_time = self.last_ack = time.monotonic()
+            # Nothing is left to send when the receiver holds (or has cached) all of the data already
+            if len(self.data):
+                self.fill()
+            else:
+                self.close_data()
+        elif self.state == 'DATA' and ACK:
+            self.on_ack(seq, ack, msg[12:])
+        elif self.state == 'FIN' and ACK and ack == 0:
+            self.timer.cancel()
+            self.transport.close()
+            if flags & reject_flag:
+                self.done.set_exception(ConnectionError("the receiver rejected the data"))
+            else:
+                self.done.set_result(self.lapsed_time)
+
+    def send(self, sequence):
+        # Sends segment #sequence, and starts its timer
+        if self.digest is not None:
+            # A checked transfer sends the CRC32 of the segment, and hashes the segments in order for the FIN
+            started = time.perf_counter()
+            payload = self.data[sequence - 1]
+            packet = checked_struct.pack(sequence, 0, 0, 0, segment_crc(sequence, payload)) + payload
+            self.digest.through(self.data, sequence)
+            self.metrics.checksum_time += time.perf_counter() - started
+        else:
+            packet = create_packet(sequence, 0, 0, 0, self.data[sequence - 1])
+        if sequence == self.skip_seq:
+            self.skip_seq = 0  # Skips the packet once, for the test case
+        else:
+            self.transport.sendto(packet)
+            self.metrics.sent += 1
+        self.pacer.consume()
+        if sequence in self.sent_at:
+            self.retransmitted.add(sequence)
+            self.metrics.retransmissions += 1
+        now = time.monotonic()
+        self.sent_at[sequence] = now
+        self.highest_sent = max(self.highest_sent, sequence)
+
+        if self.reliability == 'SR':
+            self.timers[sequence] = self.loop.call_later(self.rto.timeout, self.packet_timeout, sequence)
+        elif self.timer is None:
+            self.timer = self.loop.call_later(self.rto.timeout, self.window_timeout)
+
+    def fill(self):
+        # Sends as many new packets as the window and the pacer allow
+        if self.pace_timer is not None:
+            return  # The pacer holds the next packet back
+        while self.next_sequence < self.sequence + self.cc.window() and self.next_sequence <= len(self.data):
+            if self.next_sequence not in self.acked:
+                wait = self.pacer.delay()
+                if wait:
+                    self.pace_timer = self.loop.call_later(wait, self.paced_fill)
+                    return
+                self.send(self.next_sequence)
+            self.next_sequence += 1
+
+    def paced_fill(self):
+        self.pace_timer = None
+        self.fill()
+
+    def sample(self, sequence):
+        # Takes an RTT sample from the packet that triggered the ack
+        measured = time.monotonic() - self.sent_at[sequence]
+        self.rto.sample(measured)
+        self.metrics.rtt(measured, self.rto.srtt)
+
+    def on_ack(self, seq, ack, body):
+        # The ack is cumulative, and for SR the selective ack blocks add the ranges held beyond it
+        acked = 0
+        self.metrics.acks += 1
+        if self.sequence <= ack <= self.highest_sent:
+            self.dupacks = 0
+            # Sets rtt from the packet that triggered the ack, if it was not retransmitted
+            if self.sequence <= seq <= ack and seq not in self.retransmitted and seq not in self.acked:
+                self.sample(seq)
+            while self.sequence <= ack:
+                if self.sequence not in self.acked:
+                    acked += 1
+                    timer = self.timers.pop(self.sequence, None)
+                    if timer is not None:
+                        timer.cancel()
+                self.acked.discard(self.sequence)
+                self.retransmitted.discard(self.sequence)
+                del self.sent_at[self.sequence]
+                self.sequence += 1
+            self.data.release(self.sequence)  # Pages behind the window are no longer needed
+            self.next_sequence = max(self.next_sequence, self.sequence)
+            # Restarts the timer for the oldest unacknowledged sequence
+            if self.timer is not None:
+                self.timer.cancel()
+                self.timer = None
+                if self.sequence <= self.highest_sent:
+                    self.timer = self.loop.call_later(self.rto.timeout, self.window_timeout)
+
+        elif self.reliability == 'GBN' and ack == self.sequence - 1 and self.highest_sent >= self.sequence:
+            # Fast retransmit after three duplicate acks
+            self.dupacks += 1
+            if self.dupacks == dupack_threshold and ack >= self.recover:
+                self.metrics.fast_retransmits += 1
+                self.recover = self.highest_sent
+                self.cc.on_loss(self.highest_sent)
+                self.next_sequence = self.sequence
+            elif self.dupacks > dupack_threshold:
+                self.cc.on_dupack()
+
+        if self.reliability == 'SR':
+            for first, last in parse_sack(body):
+                for i in range(max(first, self.sequence), min(last, self.highest_sent) + 1):
+                    if i not in self.acked and i in self.timers:
+                        self.acked.add(i)
+                        self.timers.pop(i).cancel()
+                        acked += 1
+                        if i == seq and i not in self.retransmitted:
+                            self.sample(i)
+
+        if acked:
+            self.last_ack = time.monotonic()
+            self.cc.on_ack(acked, ack, self.rto.srtt)
+            self.pacer.update(self.cc, self.rto.srtt)
+        else:
+            self.metrics.duplicate_acks += 1
+        self.metrics.tick(self.sequence - 1, self.next_sequence - self.sequence, self.cc.cwnd, self.rto)
+
+        if self.sequence > len(self.data):
+            self.close_data()
+        else:
+            self.fill()
+
+    def close_data(self):
+        # All data sent and acked - closes the connection
+        self.lapsed_time = (time.monotonic() - self.start_time) * 1000
+        if self.digest is not None:
+            started = time.perf_counter()
+            self.digest.digest()  # Kept for the FIN
+            self.metrics.checksum_time += time.perf_counter() - started
+        self.metrics.finish(self.data.size, len(self.data))
+        if isinstance(self.data, CompressedSource):
+            log_compression(self.data)
+        self.state = 'FIN'
+        self.attempts = 0
+        if self.timer is not None:
+            self.timer.cancel()
+        if self.pace_timer is not None:
+            self.pace_timer.cancel()
+        self.send_control(2)  # 0 0 1 0  FIN flag
+
+    def idle(self):
+        # Gives up the transfer like check_idle() when nothing has been acked for idle_timeout seconds
+        if time.monotonic() - self.last_ack < idle_timeout:
+            return False
+        for timer in [self.timer, self.pace_timer] + list(self.timers.values()):
+            if timer is not None:
+                timer.cancel()
+        if not self.done.done():
+            self.done.set_exception(TimeoutError("the receiver stopped acking the data"))
+        return True
+
+    def window_timeout(self):
+        # Stop-and-wait and GBN: goes back N from the oldest unacknowledged sequence
+        self.timer = None
+        if self.idle():
+            return
+        self.metrics.timeouts += 1
+        self.rto.backoff()
+        self.cc.on_timeout()
+        self.next_sequence = self.sequence
+        self.fill()
+
+    def packet_timeout(self, sequence):
+        # SR: resends only the packet whose own timer expired
+        del self.timers[sequence]
+        if self.idle():
+            return
+        self.metrics.timeouts += 1
+        # Backs off once per loss event, and again for packets that were sent after the backoff
+        if self.sent_at[sequence] >= self.last_backoff:
+            self.rto.backoff()
+            self.cc.on_timeout()
+            self.last_backoff = time.monotonic()
+        self.send(sequence)
+
+
+# A coroutine that sends a file name or a bytes-like object (or the byte range of a stream) to the server,
+# and returns the data size and the elapsed time of the transfer in ms
+# The transfer runs on its own datagram endpoint, so many of them can run on one event loop
+async def send_async(sender, source, stream=None):
+    loop = asyncio.get_running_loop()
+    transport, protocol = await loop.create_datagram_endpoint(
+        lambda: DRTPClientProtocol(sender, source, stream), remote_addr=sender.address)
+    try:
+        lapsed_time = await protocol.done
+        return protocol.data.size, lapsed_time
+    finally:
+        transport.close()
+        if protocol.data is not None:
+            protocol.data.close()
+        if protocol.digest is not None:
+            protocol.digest.close()
+
+
+# A class that serves the clients from an asyncio event loop with the same sessions as serve()
+class DRTPServerProtocol(asyncio.DatagramProtocol):
+    def __init__(self, receiver, output, keep_running):
+        self.loop = asyncio.get_running_loop()
+        self.done = self.loop.create_future()  # Set to the first transfer when the server shuts down
+        self.keep_running = keep_running
+        self.table = SessionTable(receiver, output, keep_running)
+        self.transport = None
+        self.ack_timers = {}  # Timer of the delayed ack of each session
+        self.finished = None  # Session that finished the first transfer, without keep_running
+
+    def connection_made(self, transport):
+        self.transport = transport
+        self.loop.call_later(1, self.sweep)
+
+    def datagram_received(self, msg, address):
+        session, reply = self.table.dispatch(msg, address)
+        if session is None:
+            return
+        if reply is not None:
+            self.transport.sendto(reply, address)
+        # Schedules the delayed ack once, when it is first held back
+        if session.delayed.msg is not None and session not in self.ack_timers:
+            self.ack_timers[session] = self.loop.call_later(session.delayed.timeout(), self.send_delayed, session)
+        # Without keep_running, the server shuts down after the first transfer, once the client has sent
+        # nothing for time_wait (see serve)
+        if session.transfer.finished and not self.keep_running and self.finished is None:
+            self.finished = session
+            self.loop.call_later(time_wait, self.time_wait)
+
+    def send_delayed(self, session):
+        del self.ack_timers[session]
+        if session.delayed.msg is not None:
+            reply, address = session.delayed.expire()
+            self.transport.sendto(reply, address)
+
+    def time_wait(self):
+        # Shuts the server down once the client of the finished transfer has stopped resending its FIN
+        wait = self.finished.last_packet + time_wait - time.monotonic()
+        if wait > 0:
+            self.loop.call_later(wait, self.time_wait)
+        elif not self.done.done():
+            self.done.set_result(self.finished.transfer)
+
+    def sweep(self):
+        # Drops the sessions that have been idle for too long, once a second
+        aborted = self.table.expire(time.monotonic())
+        if aborted and not self.keep_running and self.finished is None and not self.done.done():
+            self.done.set_result(aborted[0].transfer)
+        self.loop.call_later(1, self.sweep)
+
+
+# A coroutine that serves the clients on the socket of the receiver until the server shuts down
+async def serve_async(receiver, output, keep_running):
+    loop = asyncio.get_running_loop()
+    transport, protocol = await loop.create_datagram_endpoint(
+        lambda: DRTPServerProtocol(receiver, output, keep_running), sock=receiver.socket)
+    try:
+        return await protocol.done
+    finally:
+        transport.close()
+
+
+# A function that sends one stream of a parallel transfer from a process of its own, and returns the
+# data size and the wall clock times of the first SYN and of the acked FIN
+def send_stream(address, settings, source, stream, use_asyncio):
+    with DRTPSender(address, **settings) as sender:
+        start_time = time.time()
+        if use_asyncio:
+            data_size = asyncio.run(send_async(sender, source, stream))[0]
+        else:
+            data_size = sender.send(source, stream)[0]
+        return data_size, start_time, time.time()
+
+
+# Library interface #
+# A class that sends files to a DRTP receiver. The socket and the retransmission timeout are kept
+# between transfers, so one sender can make many transfers without starting over from the default RTO
+class DRTPSender:
+    def __init__(self, address, reliability='stop-and-wait', window=5, cc='none', test=None, io_mode='single',
+                 rate=0, pace=False, mss=chunk_size, sock=None, report=None, report_interval=0, resume=False,
+                 dedup=False, compression=None, level=None, checksum=False):
+        self.address = address  # Address of the receiver
+        self.reliability = reliability  # 'stop-and-wait', 'GBN' or 'SR'
+        self.window = window  # Window size in packets, lowered to the one advertised in the SYN ACK
+        self.cc = cc  # Name of the congestion control in congestion_controls
+        self.test = test  # 'skip_seq' skips the first sending of a packet
+        self.rate = rate  # Pacing rate of GBN and SR in bytes per second, 0 for none
+        self.pace = pace  # Whether GBN and SR are paced at a rate that follows the window and the SRTT
+        # Segment size proposed in the SYN, lowered to the one chosen in the SYN ACK
+        self.mss = mss = min(mss, max_mss)
+        self.socket = sock if sock is not None else socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        # A segment size above the default is probed with the SYN, so datagrams must not be fragmented:
+        # with the don't-fragment bit set, a SYN larger than the known path MTU fails with EMSGSIZE
+        if mss > chunk_size:
+            set_dont_fragment(self.socket)
+        # Sends the data and receives the acks
+        self.io = DatagramIO(self.socket, io_mode, ack_size, send_size=12 + mss)
+        self.rto = RTOEstimator()  # Retransmission timeout shared by the handshakes, the transfers and the FINs
+        self.report = report  # Called with the metrics of every transfer (see TransferMetrics)
+        self.report_interval = report_interval  # Seconds between two snapshots of the metrics, 0 for none
+        self.metrics = None  # TransferMetrics of the last transfer
+        self.resume = resume  # Whether a transfer asks to resume after the bytes the receiver holds already
+        self.dedup = dedup  # Whether a transfer only sends the blocks that are not in the cache of the receiver
+        # 'zlib' or 'lzma' to send the data compressed at level (the default of the method for None), if the
+        # receiver accepts it, or None to send it as it is
+        self.compression = compression
+        self.level = level
+        self.checksum = checksum  # Whether a transfer asks for a CRC32 in every data packet and a digest in the FIN
+        self.digest = None  # SegmentDigest of the segments sent by a checked transfer
+
+    def connect(self, stream=None, file_id=0, manifest=None):
+        # Three-way handshake: returns the negotiated window and segment size, the bytes the receiver holds
+        # already of a resumable transfer, the bitmap of the blocks it needs of a deduplicated one (None
+        # if it does not deduplicate) and the flags of the options it accepted (compress_flag and
+        # checksum_flag), or raises TimeoutError if the receiver does not answer the SYN.
+        # stream is the (transfer id, start, size) of a stream of a parallel transfer, file_id the id of
+        # the data of a resumable transfer (see source_id) and manifest the blocks of a deduplicated one
+        # The SYN proposes the segment size and probes the path with it (see create_syn): a SYN that is too
+        # large to be sent is resent at once with a smaller one, and one that times out is resent with a
+        # smaller one too, down to the default chunk size
+        mss = self.mss
+        attempt = 0
+        while attempt <= max_retries:
+            # S A F R - SYN ACK FIN RST
+            try:
+                syn = create_syn(mss, stream, file_id, manifest, self.compression is not None, self.checksum)
+                self.socket.sendto(syn, self.address)  # 1 0 0 0  SYN flag
+            except OSError as error:
+                if error.errno != errno.EMSGSIZE or mss <= chunk_size:
+                    raise
+                mss = smaller_mss(mss)
+                logger.info("SYN too large for the path: proposing a segment size of %s bytes", mss)
+                continue
+            logger.info("SYN sent")
+            syn_sent_at = time.monotonic()
+            deadline = syn_sent_at + self.rto.timeout
+            logger.info("Setting timeout: %.0f ms", self.rto.timeout * 1000)
+
+            # Waits for the SYN ACK, and skips stale acks left over from an earlier transfer
+            while True:
+                self.socket.settimeout(max(deadline - time.monotonic(), min_wait))
+                try:
+                    syn_ack_msg = self.socket.recv(max_syn)
+                except socket.timeout:
+                    break
+
+                # Parsing the header
+                seq, ack, flags, win = parse_header(syn_ack_msg[:12])  # SYN ACK -> flags set to: 1 1 0 0
+                SYN, ACK, FIN = parse_flags(flags)
+                if not (SYN and ACK):
+                    continue
+                logger.info("SYN ACK received: flags set: syn-> %s, ack-> %s, fin-> %s", SYN, ACK, FIN)
+
+                # The handshake gives an RTT sample, unless the SYN was resent
+                if attempt == 0:
+                    self.rto.sample(time.monotonic() - syn_sent_at)
+
+                # The window is the smallest of our own and the one advertised by the receiver
+                window = min(self.window, win) if win else self.window
+                logger.info("Window negotiated: %s packets", window)
+                # The segment size is the one chosen by the receiver, or the default if it did not send one
+                chosen, held, bitmap = parse_syn_ack(syn_ack_msg)
+                mss = min(mss, chosen)
+                logger.info("Segment size negotiated: %s bytes", mss)
+                if held:
+                    logger.info("Resuming after %s bytes held by the receiver", held)
+                # The options are only used if they were asked for and accepted
+                options = flags & ((compress_flag if self.compression is not None else 0)
+                                   | (checksum_flag if self.checksum else 0))
+                if options & compress_flag:
+                    logger.info("Sending the data compressed with %s", self.compression)
+                if options & checksum_flag:
+                    logger.info("Sending the data with checksums")
+
+                # Sending ACK to confirm an established connection
+                self.socket.sendto(create_packet(0, 0, 4, 0, b''), self.address)  # 0 1 0 0  ACK flag
+                logger.info("ACK sent")
+                logger.info("Connection established..")
+                return window, mss, held if file_id else 0, bitmap if manifest is not None else None, options
+
+            logger.info("Timed out: Didn't receive a SYN ACK")
+            self.rto.backoff()
+            attempt += 1
+            if mss > chunk_size:
+                mss = smaller_mss(mss)
+                logger.info("Proposing a segment size of %s bytes", mss)
+        raise TimeoutError("the receiver did not answer the SYN")
+
+    def disconnect(self, digest=b''):
+        # Sends the FIN, and resends it with backoff until it is acked. Raises TimeoutError if it never is.
+        # The FIN of a checked transfer carries the digest of the segments. Raises ConnectionError if the
+        # receiver rejects the data
+        msg = create_packet(0, 0, 2, 0, digest)  # 0 0 1 0  FIN flag
+        for attempt in range(max_retries + 1):
+            self.socket.sendto(msg, self.address)
+            logger.info("FIN sent")
+            deadline = time.monotonic() + self.rto.timeout
+
+            while True:
+                self.socket.settimeout(max(deadline - time.monotonic(), min_wait))
+                try:
+                    ack_msg = self.socket.recv(ack_size)
+                except socket.timeout:
+                    break
+
+                # Parsing the header
+                seq, ack, flags, win = parse_header(ack_msg[:12])  # ACK -> flags set to: 0 1 0 0
+                SYN, ACK, FIN = parse_flags(flags)
+                if ACK and ack == 0:
+                    logger.info("ACK received: flags set: syn-> %s, ack-> %s, fin-> %s", SYN, ACK, FIN)
+                    if flags & reject_flag:
+                        raise ConnectionError("the receiver rejected the data")
+                    return
+
+            logger.info("Timed out: Did not receive a FIN ACK")
+            self.rto.backoff()
+        raise TimeoutError("the receiver did not ack the FIN")
+
+    def send(self, source, stream=None):
+        # Sends a file name or a bytes-like object over a new connection, and returns the data size and the
+        # elapsed time in ms. The data is split into segments of the size negotiated in the handshake.
+        # With stream (transfer id, start, length, size) only that byte range is sent, as a stream of a
+        # parallel transfer (see send_parallel). A resumed transfer only sends what the receiver is missing,
+        # and a deduplicated one only the blocks the receiver does not have in its cache
+        manifest = create_manifest(source) if self.dedup and stream is None else None
+        file_id = source_id(source) if self.resume and manifest is None else 0
+        window, mss, held, bitmap, options = self.connect(syn_stream(stream), file_id, manifest)
+        start, length = stream[1:3] if stream else (0, None)
+        ranges = needed_ranges(manifest, bitmap) if bitmap is not None else None
+        compression = self.compression if options & compress_flag else None
+        # The segments of a checked transfer leave room for the CRC32, so the packets are no larger
+        size = max(mss - crc_struct.size, 1) if options & checksum_flag else mss
+        self.digest = SegmentDigest() if options & checksum_flag else None
+        # The file is streamed from a memory-mapping shared by all three methods
+        with open_source(source, size, start + held, None if length is None else length - held, ranges,
+                         compression, self.level) as data:
+            self.metrics = TransferMetrics(self.io, self.report, self.report_interval,
+                                           reliability=self.reliability, cc=self.cc, window=window, mss=mss,
+                                           compression=compression)
+            self.rto.metrics = self.metrics  # The metrics also get the RTT samples
+            try:
+                start_time = time.time()
+                data_size = 0
+                if self.reliability == "stop-and-wait":
+                    data_size = stop_and_wait_c(self, data)
+                elif self.reliability == "GBN":
+                    data_size = gbn_c(self, data, window)
+                elif self.reliability == "SR":
+                    data_size = sr_c(self, data, window)
+                # Lapsed time in ms
+                lapsed_time = (time.time() - start_time) * 1000
+                digest = b''
+                if self.digest is not None:
+                    started = time.perf_counter()
+                    digest = self.digest.digest()
+                    self.metrics.checksum_time += time.perf_counter() - started
+                self.metrics.finish(data_size, len(data))
+                if compression is not None:
+                    log_compression(data)
+            finally:
+                self.rto.metrics = None
+                if self.digest is not None:
+                    self.digest.close()
+                    self.digest = None
+        self.disconnect(digest)
+        return data_size, lapsed_time
+
+    def send_file(self, filename):
+        return self.send(filename)
+
+    def send_bytes(self, payload):
+        return self.send(payload)
+
+    async def send_file_async(self, filename):
+        # Sends the file from an asyncio event loop, on a datagram endpoint of its own
+        return await send_async(self, filename)
+
+    async def send_bytes_async(self, payload):
+        return await send_async(self, payload)
+
+    def send_parallel(self, source, streams, use_asyncio=False):
+        # Splits the file into byte ranges and sends each as a stream over a connection of its own, from a
+        # process of its own, so the transfer is not limited by the packet rate of one Python process.
+        # The receiver writes the ranges into one output file. Returns the data size and the elapsed time
+        # in ms from the first SYN to the last FIN
+        with ChunkSource(source) as data:
+            size = data.size
+        streams = min(streams, -(-size // self.mss))  # Every stream gets at least one segment
+        if streams <= 1:
+            return asyncio.run(send_async(self, source)) if use_asyncio else self.send(source)
+
+        # Tells the transfers of one host apart. A resumable transfer keeps its id, so it is written to the
+        # same file when it is resumed
+        if self.resume:
+            transfer_id = source_id(source) & 0xffffffff or 1
+        else:
+            transfer_id = int.from_bytes(os.urandom(4), 'big') or 1
+        bounds = [size * i // streams for i in range(streams + 1)]
+        # The settings of this sender, for the senders of the streams. The rate is shared between them, and
+        # every stream reports its own metrics, so report has to be a function that can be pickled
+        settings = dict(reliability=self.reliability, window=self.window, cc=self.cc, test=self.test,
+                        io_mode=self.io.mode, rate=self.rate / streams, pace=self.pace, mss=self.mss,
+                        report=self.report, report_interval=self.report_interval, resume=self.resume,
+                        compression=self.compression, level=self.level, checksum=self.checksum)
+        jobs = [(self.address, settings, source, (transfer_id, bounds[i], bounds[i + 1] - bounds[i], size),
+                 use_asyncio) for i in range(streams)]
+
+        # Forked processes start at once, and do not import the program that uses the library again
+        if 'fork' in multiprocessing.get_all_start_methods():
+            context = multiprocessing.get_context('fork')
+        else:
+            context = multiprocessing.get_context()
+        with context.Pool(streams) as pool:
+            results = pool.starmap(send_stream, jobs)
+        data_size = sum(result[0] for result in results)
+        lapsed_time = (max(result[2] for result in results) - min(result[1] for result in results)) * 1000
+        return data_size, lapsed_time
+
+    def close(self):
+        self.socket.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+# A class that receives files from DRTP senders on a bound socket, one session per sender
+class DRTPReceiver:
+    def __init__(self, address, reliability='stop-and-wait', window=5, ack_every=1, ack_delay=0.005,
+                 batch=64, preallocate=False, max_sessions=16, test=None, io_mode='single', mss=chunk_size,
+                 sock=None, reuse_port=False, report=None, resume=False, cache=None, cache_size=cache_limit):
+        self.address = address  # Address the socket is bound to
+        self.reliability = reliability  # 'stop-and-wait', 'GBN' or 'SR'
+        self.window = window  # Window advertised in the SYN ACK
+        self.ack_every = ack_every  # Delayed acks: one ack for every N in-order packets
+        self.ack_delay = ack_delay  # Longest time in seconds an ack is delayed
+        self.batch = batch  # Number of in-order segments written to the output file at once
+        self.preallocate = preallocate  # Whether disk space for the output file is reserved ahead
+        self.max_sessions = max_sessions  # Number of senders served at the same time
+        self.test = test  # 'skip_ack' drops an ack once
+        self.mss = mss = min(mss, max_mss)  # Largest segment size accepted in the SYN
+        self.report = report  # Called with the stats of every finished or aborted session
+        self.resume = resume  # Whether unfinished transfers are checkpointed, so they can be resumed
+        # Blocks of the received files, kept in the cache directory for deduplicated transfers
+        self.cache = BlockCache(cache, cache_size) if cache is not None else None
+        if sock is None:
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            # With reuse_port many processes bind the same port, and the kernel spreads the clients over
+            # them by the hash of their addresses
+            if reuse_port:
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+            sock.bind(address)
+        self.socket = sock
+        # Receives the data and sends the acks. The data is received into a ring with room for the window,
+        # a batch of the writer and a drain of datagrams, in buffers that fit the largest segment (or the
+        # largest SYN, whose manifest may be larger than a segment, when transfers are deduplicated)
+        size = max(12 + mss, max_syn) if cache is not None else 12 + mss
+        self.io = DatagramIO(sock, io_mode, size, slots=window + batch + io_batch)
+        # Large segments fill the default socket buffer with a few datagrams, so it is raised to hold a window
+        # of them where the system allows it
+        if mss > chunk_size:
+            try:
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, (window + io_batch) * (12 + mss))
+            except OSError:
+                pass
+
+    def receive_to(self, output):
+        # Receives one transfer into the output file, and returns the number of bytes written.
+        # Raises TimeoutError if the sender goes silent before the FIN, and ConnectionError if the transfer
+        # failed (see ReceiverSession.error)
+        session = serve(self, output, False)
+        if not session.finished:
+            raise TimeoutError(f"the transfer from {session.address} timed out")
+        if session.error is not None:
+            raise ConnectionError(f"the transfer from {session.address} failed: {session.error}")
+        return session.data_size
+
+    def serve_forever(self, output):
+        # Receives transfers until the process is stopped, one output file per connection (see output_name)
+        serve(self, output, True)
+
+    async def receive_to_async(self, output):
+        session = await serve_async(self, output, False)
+        if not session.finished:
+            raise TimeoutError(f"the transfer from {session.address} timed out")
+        if session.error is not None:
+            raise ConnectionError(f"the transfer from {session.address} failed: {session.error}")
+        return session.data_size
+
+    async def serve_forever_async(self, output):
+        await serve_async(self, output, True)
+
+    def close(self):
+        self.socket.close()
+        if self.cache is not None:
+            self.cache.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+# Multi-process server #
+# A function that serves one worker of serve_workers: a DRTPReceiver on its own SO_REUSEPORT socket, which
+# sends the stats of its sessions (or the error that stopped it) to the supervisor through reports
+def serve_worker(index, address, output, keep_running, use_asyncio, settings, reports):
+    try:
+        with DRTPReceiver(address, reuse_port=True, report=lambda stats: reports.put((index, stats)),
+                          **settings) as receiver:
+            if use_asyncio:
+                asyncio.run(serve_async(receiver, output, keep_running))
+            else:
+                serve(receiver, output, keep_running)
+    except KeyboardInterrupt:
+        pass
+    except OSError as error:
+        reports.put((index, error))
+
+
+# A function that serves the clients from workers processes that all bind the port with SO_REUSEPORT, so
+# the kernel spreads the connections over them by their 4-tuple and the receive side uses many cores.
+# settings are the arguments of DRTPReceiver. The supervisor adds up the stats of every worker, and joins
+# the streams of a parallel transfer that were served by different workers. Without keep_running it stops
+# after the first transfer. report is called in the supervisor with the stats of every session and the index
+# of its worker. Returns the stats of each worker
+def serve_workers(address, workers, output, keep_running=False, use_asyncio=False, report=None, **settings):
+    if not hasattr(socket, 'SO_REUSEPORT'):
+        raise OSError("SO_REUSEPORT is not available on this system")
+    # Forked workers start at once, and do not import the program that uses the library again
+    if 'fork' in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context('fork')
+    else:
+        context = multiprocessing.get_context()
+    reports = context.Queue()
+    processes = [context.Process(target=serve_worker,
+                                 args=(i, address, output, keep_running, use_asyncio, settings, reports))
+                 for i in range(workers)]
+    for process in processes:
+        process.start()
+
+    stats = [dict(transfers=0, data_size=0, packets=0, acks=0, cpu_time=0) for i in range(workers)]
+    transfers = {}  # Bytes written to each parallel transfer by all the workers, by (host, transfer id)
+    try:
+        while True:
+            try:
+                index, session = reports.get(timeout=1)
+            except queue.Empty:
+                # Stops when every worker has stopped on its own
+                if not any(process.is_alive() for process in processes):
+                    break
+                continue
+            if isinstance(session, OSError):
+                raise session
+            worker = stats[index]
+            worker['transfers'] += 1
+            for key in ('data_size', 'packets', 'acks', 'cpu_time'):
+                worker[key] += session[key]
+            status = " (timed out)" if not session['finished'] else f" ({session['error']})" if session['error'] else ""
+            logger.info("Worker %s: %s bytes from %s written to %s%s", index, session['data_size'],
+                        session['address'], session['output'], status)
+            if report is not None:
+                report(dict(session, worker=index))
+
+            done = True
+            if session['transfer'] is not None and session['finished']:
+                host, transfer_id, size = session['transfer']
+                received = transfers.get((host, transfer_id), 0) + session['resumed'] + session['data_size']
+                transfers[(host, transfer_id)] = received
+                done = received >= size
+                if done:
+                    del transfers[(host, transfer_id)]
+                    logger.info("Parallel transfer finished: %s bytes written to %s", received, session['output'])
+            # Without keep_running, the server shuts down after the first transfer, once the worker has had
+            # the time to ack the FIN and any FIN that is resent (it reports the session just before it sends
+            # the ack, and stops on its own after time_wait if the transfer is all its own)
+            if done and not keep_running:
+                processes[index].join(time_wait + rtt)
+                break
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.join()
+
+    # Stats of every worker and of all of them
+    logger.info("%8s %10s %12s %10s %10s %12s", 'worker', 'transfers', 'bytes', 'packets', 'ACKs', 'CPU time')
+    for i, worker in enumerate(stats + [{key: sum(w[key] for w in stats) for key in stats[0]}]):
+        name = str(i) if i < workers else 'total'
+        logger.info("%8s %10s %12s %10s %10s %10.2fms", name, worker['transfers'], worker['data_size'],
+                    worker['packets'], worker['acks'], worker['cpu_time'])
+    return stats
@@ -0,0 +1,237 @@
+# UDP impairment proxy for testing DRTP without Mininet
+# The proxy sits between the DRTP clients and the server and drops, delays, jitters, reorders, duplicates,
+# corrupts and rate-limits the datagrams in both directions. The random choices come from a seeded generator, so a
+# run with the same seed and the same packets makes the same choices
+#
+#   python3 application.py -s -r SR -p 8088
+#   python3 impair.py -l 8089 -p 8088 --loss 2 --delay 5 --seed 1
+#   python3 application.py -c -r SR -p 8089 -f safi.jpg
+
+import argparse  # In order to utilize arguments
+import socket  # Import of socket module
+import select  # In order to wait for datagrams and for the delayed ones to be due
+import heapq  # In order to keep the delayed datagrams ordered by send time
+import random  # In order to make the seeded random choices
+import threading  # In order to run the proxy next to the client or the server
+import time  # In order to utilize time
+from drtp import parse_header  # In order to recognise the DRTP data packets
+
+# GLOBAL VARIABLES #
+max_datagram = 65535  # Largest datagram forwarded
+poll_interval = 0.1  # Longest wait between two checks of the stop event
+
+
+# A class that forwards the datagrams between the clients and the server through an impaired link
+# Each client gets a socket of its own towards the server, so the server still sees one address per
+# client. Both directions have their own link, impaired with the same settings:
+#   loss, duplicate, reorder and corrupt are probabilities in percent (corrupt flips a bit in the payload of
+#   a data packet, the headers and the acks are left alone), delay, jitter and reorder_delay are in
+#   seconds, bandwidth is in bits per second (0 for none) and limit is the number of packets that may
+#   wait for the bandwidth before the next one is dropped (0 for no limit)
+class ImpairmentProxy:
+    def __init__(self, listen, server, loss=0, delay=0, jitter=0, reorder=0, reorder_delay=0.002,
+                 duplicate=0, bandwidth=0, limit=0, seed=None, corrupt=0):
+        self.server = server  # Address of the DRTP server
+        self.loss = loss
+        self.delay = delay
+        self.jitter = jitter
+        self.reorder = reorder
+        self.reorder_delay = reorder_delay  # Extra delay of a reordered packet
+        self.duplicate = duplicate
+        self.corrupt = corrupt
+        self.bandwidth = bandwidth
+        self.limit = limit
+        self.random = random.Random(seed)
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)  # Receives from the clients
+        self.sock.bind(listen)
+        self.address = self.sock.getsockname()  # Address the clients send to
+        self.upstreams = {}  # Socket towards the server, by client address
+        self.clients = {}  # Client address, by socket towards the server
+        self.delayed = []  # Heap of (send time, number, socket, datagram, destination)
+        self.count = 0  # Number of datagrams delayed so far, to keep the heap in arrival order on ties
+        self.link_free = {'up': 0, 'down': 0}  # When each link has sent the datagrams before it
+        self.queued = {'up': [], 'down': []}  # Times the queued datagrams of each link leave the queue
+        self.seen = set()  # (client address, sequence) of the data packets sent so far
+        self.stats = {direction: dict(packets=0, bytes=0, dropped=0, duplicated=0, reordered=0, corrupted=0)
+                      for direction in ('up', 'down')}
+        self.stats['up'].update(data_packets=0, retransmissions=0)
+        self.thread = None
+        self.stop_event = threading.Event()
+
+    def forward(self, datagram, direction, sock, destination, client):
+        # Takes a datagram that arrived on one side, and schedules it on the link to the other side
+        stats = self.stats[direction]
+        stats['packets'] += 1
+        stats['bytes'] += len(datagram)
+
+        # Counts the data packets of the client (and the ones that were sent before) as they enter the link
+        data = False
+        if direction == 'up' and len(datagram) >= 12:
+            seq, ack, flags, win = parse_header(datagram)
+            data = seq > 0 and flags == 0 and len(datagram) > 12
+            if seq > 0 and flags == 0:
+                stats['data_packets'] += 1
+                if (client, seq) in self.seen:
+                    stats['retransmissions'] += 1
+                self.seen.add((client, seq))
+
+        if self.random.random() * 100 < self.loss:
+            stats['dropped'] += 1
+            return
+        # Flips a bit of the payload, which only a checked transfer notices
+        if self.corrupt and data and self.random.random() * 100 < self.corrupt:
+            stats['corrupted'] += 1
+            datagram = bytearray(datagram)
+            datagram[self.random.randrange(12, len(datagram))] ^= 1 << self.random.randrange(8)
+            datagram = bytes(datagram)
+        copies = 1
+        if self.random.random() * 100 < self.duplicate:
+            stats['duplicated'] += 1
+            copies = 2
+
+        for i in range(copies):
+            now = time.monotonic()
+            leave = now
+            if self.bandwidth:
+                # Tail drop when the queue of the link is full
+                queued = self.queued[direction]
+                while queued and queued[0] <= now:
+                    queued.pop(0)
+                if self.limit and len(queued) >= self.limit:
+                    stats['dropped'] += 1
+                    continue
+                # The datagram leaves the queue when the link has sent it and every datagram before it
+                leave = max(now, self.link_free[direction]) + len(datagram) * 8 / self.bandwidth
+                self.link_free[direction] = leave
+                queued.append(leave)
+
+            delay = self.delay
+            if self.jitter:
+                delay = max(0, delay + self.random.uniform(-self.jitter, self.jitter))
+            if self.random.random() * 100 < self.reorder:
+                stats['reordered'] += 1
+                delay += self.reorder_delay  # Lets the datagrams behind it overtake it
+            self.count += 1
+            heapq.heappush(self.delayed, (leave + delay, self.count, sock, datagram, destination))
+
+    def upstream(self, client):
+        # Returns the socket towards the server of the client, and opens it on the first datagram
+        sock = self.upstreams.get(client)
+        if sock is None:
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            sock.connect(self.server)
+            sock.setblocking(False)
+            self.upstreams[client] = sock
+            self.clients[sock] = client
+        return sock
+
+    def serve(self, stop=None):
+        # Forwards the datagrams until the stop event is set (or forever without one)
+        stop = stop or self.stop_event
+        self.sock.setblocking(False)
+        while not stop.is_set():
+            now = time.monotonic()
+            timeout = poll_interval
+            if self.delayed:
+                timeout = min(timeout, max(0, self.delayed[0][0] - now))
+            readable = select.select([self.sock] + list(self.clients), [], [], timeout)[0]
+
+            # Drains every socket that has datagrams waiting
+            for sock in readable:
+                while True:
+                    try:
+                        if sock is self.sock:
+                            datagram, client = sock.recvfrom(max_datagram)
+                            self.forward(datagram, 'up', self.upstream(client), None, client)
+                        else:
+                            datagram = sock.recv(max_datagram)
+                            client = self.clients[sock]
+                            self.forward(datagram, 'down', self.sock, client, client)
+                    except (BlockingIOError, ConnectionRefusedError):
+                        break
+
+            # Sends the datagrams that are due
+            now = time.monotonic()
+            while self.delayed and self.delayed[0][0] <= now:
+                send_at, count, sock, datagram, destination = heapq.heappop(self.delayed)
+                try:
+                    if destination is None:
+                        sock.send(datagram)
+                    else:
+                        sock.sendto(datagram, destination)
+                except (BlockingIOError, ConnectionRefusedError):
+                    pass  # Lost, as it would be on a full or broken link
+
+    def start(self):
+        # Runs the proxy on a thread of its own, until stop() is called
+        self.thread = threading.Thread(target=self.serve, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join()
+        return self.stats
+
+    def close(self):
+        for sock in self.upstreams.values():
+            sock.close()
+        self.sock.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+        self.close()
+
+
+# A function that prints the stats of a proxy
+def print_stats(stats):
+    for direction, name in (('up', 'client -> server'), ('down', 'server -> client')):
+        counts = ', '.join(f"{key}: {value}" for key, value in stats[direction].items())
+        print(f"{name}: {counts}")
+
+
+################
+# MAIN PROGRAM #
+################
+
+if __name__ == '__main__':
+    ###################
+    # ARGUMENT PARSER #
+    ###################
+
+    parser = argparse.ArgumentParser(
+        prog='DRTP impairment proxy',
+        description='Forwards DRTP between clients and a server through a lossy, delayed link')
+
+    parser.add_argument('-l', '--listen', type=int, default=8089, help='port the clients send to')
+    parser.add_argument('-i', '--ipaddress', type=str, default='127.0.0.1', help='ip-address of the server')
+    parser.add_argument('-p', '--port', type=int, default=8088, help='port of the server')
+    parser.add_argument('--loss', type=float, default=0, help='packets dropped in percent')
+    parser.add_argument('--delay', type=float, default=0, help='one-way delay in ms')
+    parser.add_argument('--jitter', type=float, default=0, help='the delay varies by up to this many ms')
+    parser.add_argument('--reorder', type=float, default=0, help='packets held back behind the next ones in percent')
+    parser.add_argument('--duplicate', type=float, default=0, help='packets sent twice in percent')
+    parser.add_argument('--corrupt', type=float, default=0,
+                        help='data packets with a bit flipped in their payload in percent')
+    parser.add_argument('--bandwidth', type=float, default=0, help='link rate in Mbps (0 for no limit)')
+    parser.add_argument('--limit', type=int, default=0,
+                        help='packets queued for the bandwidth before the next one is dropped (0 for no limit)')
+    parser.add_argument('--seed', type=int, help='seed of the random choices, for repeatable runs')
+
+    args = parser.parse_args()  # Start the argument parser and its arguments
+
+    proxy = ImpairmentProxy(('127.0.0.1', args.listen), (args.ipaddress, args.port), args.loss, args.delay / 1000,
+                            args.jitter / 1000, args.reorder, duplicate=args.duplicate,
+                            bandwidth=args.bandwidth * 1_000_000, limit=args.limit, seed=args.seed,
+                            corrupt=args.corrupt)
+    print(f"Forwarding port {args.listen} to {args.ipaddress}:{args.port}")
+    try:
+        proxy.serve()
+    except KeyboardInterrupt:
+        pass
+    print_stats(proxy.stats)
+    proxy.close()